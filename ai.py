@@ -0,0 +1,219 @@
+# Artificial intelligence of the bots.
+#
+# All bots of a world are controlled together: their targets are chosen and
+# their directions are computed for all of them at once with NumPy, such that
+# matches with many bots are possible.
+#
+# Thinking is separated from steering.  When a bot thinks, it chooses its
+# target, predicts where it can catch it (the intercept point), checks the
+# way there for dangerous walls and decides whether to use the booster; the
+# result is its plan.  In every step, the bots only steer towards the goals
+# of their plans, which is cheap.  The bots think in turns, a few of them in
+# every step, and at most for a given time per step (the budget), such that
+# smarter bots do not slow down the game: if time is short, the plans are
+# just kept a little longer.
+#
+# This module does not depend on pygame.
+
+import time
+
+import numpy as np
+
+from world import CT, SpatialHash
+
+
+class BotController:
+    """Let the figures 'bots' of 'world' chase the nearest living victim.
+
+    'victims' are the indices of the figures the bots are after; by default,
+    these are all figures, such that every bot chases the nearest other
+    figure, bot or not.
+
+    Every bot thinks about every 'think_every' steps.  If 'budget' is given,
+    the bots think for at most about 'budget' seconds per step, and the bots
+    left out are the first ones in the next step.  Without a budget, the
+    moves of the bots only depend on the state of the world, like the
+    simulation.
+    """
+
+    # Number of bots that think together, between two checks of the budget
+    batch_size = 64
+    # Longest time (in seconds) for which the motion of a target is predicted
+    horizon = 1.5
+    # Time (in seconds) of motion ahead which is checked for dangerous walls
+    lookahead = 0.5
+    # Angles (in degrees) by which a bot tries to go round dangerous walls,
+    # in the order in which they are tried
+    detours = (30, -30, 60, -60, 90, -90, 135, -135)
+    # Shortest time (in seconds of the world) between two boosts of a bot
+    boost_every = 1.0
+
+    def __init__(self, world, bots, victims=None, think_every=4, budget=None):
+        self.world = world
+        self.bots = np.asarray(bots, dtype=int)
+        self.victims = None if victims is None else np.asarray(victims, dtype=int)
+        self.think_every = think_every
+        self.budget = budget
+        # The plans: index of the figure each bot chases (-1 for none), the
+        # point it steers to and whether it activates the booster
+        self.target = np.full(len(self.bots), -1)
+        self.goal = np.zeros((len(self.bots), 2))
+        self.boost = np.zeros(len(self.bots), dtype=bool)
+        self.last_boost = np.full(len(self.bots), -np.inf)
+        # The bot which thinks next, and the number of turns to think
+        # collected (in units of 1/think_every), such that all bots think in
+        # the first step
+        self.next = 0
+        self._turns_due = len(self.bots) * (think_every - 1)
+        # Number of bots which thought in the last step, and of those which
+        # were left out because of the budget, and number of plans made so
+        # far (for profiling)
+        self.plans = 0
+        self.postponed = 0
+        self.total_plans = 0
+        self.grid = SpatialHash(2 * world.size)
+        self._danger = None
+        # The directions of the detours, as rotation matrices
+        angles = np.radians((0,) + self.detours)
+        self._rotations = np.stack((np.stack((np.cos(angles), -np.sin(angles)), axis=1),
+                                   np.stack((np.sin(angles), np.cos(angles)), axis=1)), axis=1)
+
+    def danger_map(self):
+        """Return the origin, the cell size and the grid of the cells (of
+        about half the size of a figure) in which a figure touches a deadly
+        wall or is close to touching one.
+
+        The grid is computed from the 'WallMap' of the world when it is
+        needed for the first time.
+        """
+        if self._danger is None:
+            wall_map = self.world.colcont.wall_map
+            factor = max(1, int(self.world.size / 2 // wall_map.cell_size))
+            kind = wall_map.kind
+            shape = -(-np.array(kind.shape) // factor)
+            deadly = np.zeros(shape * factor, dtype=bool)
+            deadly[:kind.shape[0], :kind.shape[1]] = kind == CT.Critical.value
+            danger = deadly.reshape(shape[0], factor, shape[1], factor).any(axis=(1, 3))
+            # A margin of one cell around the deadly cells
+            padded = np.pad(danger, 1)
+            for dx in range(3):
+                for dy in range(3):
+                    danger |= padded[dx:dx + shape[0], dy:dy + shape[1]]
+            self._danger = (wall_map.origin, factor * wall_map.cell_size, danger)
+        return self._danger
+
+    def choose_targets(self, slots):
+        """Choose the nearest living victim as target of the living bots
+        among 'slots' (indices into 'bots')."""
+        world = self.world
+        if self.victims is None:
+            victims = np.arange(world.n)
+        else:
+            victims = self.victims
+        victims = victims[world.alive[victims]]
+        living = slots[world.alive[self.bots[slots]]]
+        bots = self.bots[living]
+        nearest = self.grid.nearest(world.pos[bots], world.pos[victims],
+                                    4 * world.size, bots, victims)
+        self.target[slots] = -1
+        found = nearest >= 0
+        self.target[living[found]] = victims[nearest[found]]
+
+    def intercept(self, pos, target):
+        """Return the points at which bots at 'pos' moving with normal speed
+        catch the figures 'target' if these keep their motion."""
+        world = self.world
+        target_pos = world.pos[target]
+        velocity = world.heading[target] * world.speed[target, None]
+        # Refine the time until the bot gets to where the target will be
+        aim = target_pos
+        for _ in range(3):
+            t = np.hypot(*(aim - pos).T) / world.normalspeed
+            aim = target_pos + velocity * np.minimum(t, self.horizon)[:, None]
+        return aim
+
+    def dangers(self, start, direction, length):
+        """Return for every row of 'start' and every direction in
+        'direction' (of shape (rows, directions, 2), normalized) the number
+        of dangerous cells on the way of 'length' from 'start'."""
+        origin, cell, danger = self.danger_map()
+        # Samples every half cell, without the start
+        samples = int(np.ceil(2 * length.max(initial=0) / cell))
+        fraction = np.arange(1, samples + 1) / max(samples, 1)
+        points = (start[:, None, None, :] + direction[:, :, None, :]
+                  * (length[:, None, None, None] * fraction[:, None]))
+        index = np.floor((points - origin) / cell).astype(int)
+        inside = np.all((index >= 0) & (index < danger.shape), axis=-1)
+        np.clip(index, 0, np.array(danger.shape) - 1, out=index)
+        return np.count_nonzero(danger[index[..., 0], index[..., 1]] & inside, axis=-1)
+
+    def plan(self, slots):
+        """Let the bots 'slots' (indices into 'bots') think about their
+        next moves."""
+        world = self.world
+        self.choose_targets(slots)
+        slots = slots[self.target[slots] >= 0]
+        if len(slots) == 0:
+            return
+        bots = self.bots[slots]
+        pos = world.pos[bots]
+        aim = self.intercept(pos, self.target[slots])
+        way = aim - pos
+        distance = np.hypot(*way.T)
+        straight = way / np.maximum(distance, 1e-9)[:, None]
+        # Go straight to the intercept point, or else take the first detour
+        # with the fewest dangerous cells ahead
+        directions = np.einsum("kij,nj->nki", self._rotations, straight)
+        length = np.minimum(distance, world.normalspeed * self.lookahead)
+        choice = np.argmin(self.dangers(pos, directions, length), axis=1)
+        detour = choice > 0
+        goal = aim.copy()
+        goal[detour] = (pos[detour] + directions[detour, choice[detour]]
+                        * (world.normalspeed * self.lookahead))
+        self.goal[slots] = goal
+        # Boost when the target is close, straight ahead and the way is safe
+        aligned = np.einsum("ni,ni->n", world.heading[bots], straight) > np.cos(np.radians(20))
+        self.boost[slots] = (~detour & aligned & (world.dizzy[bots] == 0)
+                             & (distance <= world.normalspeed * self.lookahead)
+                             & (world.time - self.last_boost[slots] >= self.boost_every))
+
+    def think(self):
+        """Let the bots whose turn it is think, within the budget."""
+        n = len(self.bots)
+        self.plans = 0
+        self.postponed = 0
+        if n == 0:
+            return
+        self._turns_due += n
+        count = self._turns_due // self.think_every
+        self._turns_due -= count * self.think_every
+        turn = (self.next + np.arange(count)) % n
+        start = time.perf_counter()
+        for k in range(0, len(turn), self.batch_size):
+            if (self.budget is not None and k > 0
+                    and time.perf_counter() - start >= self.budget):
+                self.postponed = len(turn) - k
+                break
+            slots = turn[k:k + self.batch_size]
+            self.plan(slots)
+            self.plans += len(slots)
+            self.total_plans += len(slots)
+            self.next = (slots[-1] + 1) % n
+
+    def steer(self):
+        """Let all bots move as planned."""
+        world = self.world
+        bots = self.bots
+        target = self.target
+        chasing = (target >= 0) & world.alive[np.maximum(target, 0)]
+        direction = np.where(chasing[:, None], self.goal - world.pos[bots], 0.0)
+        world.direction[bots] = direction
+        for k in np.nonzero(self.boost & chasing)[0]:
+            world.activate_boost(bots[k])
+            self.last_boost[k] = world.time
+        self.boost[:] = False
+
+    def update(self):
+        """Let all bots make their moves."""
+        self.think()
+        self.steer()
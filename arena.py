@@ -0,0 +1,276 @@
+#! /usr/bin/env python3
+#
+# Arenas described in files.
+#
+# An arena is described in a text file, with one item per line:
+#
+#     # The size of the arena (in pixels of the original window)
+#     size 4000 2400
+#     # A wall: its bounding box, its type (top, bottom, left or right) and
+#     # the pattern of normal ("-") and dangerous ("X") segments along it
+#     wall 0 0 50 2400 left ---XX--XX---
+#     # A place where a figure can start
+#     spawn 100 100
+#
+# Arenas can be much larger than the window; the game then shows the part
+# around the player.  Computing the grids of the walls for the collision
+# detection (see 'WallMap') takes time for large arenas, so an arena can be
+# compiled into a binary file, which also contains the grids and is loaded
+# quickly:
+#
+#     python3 arena.py generate 16000 9600 --walls 2000 -o large.arena
+#     python3 arena.py compile large.arena
+#     python3 main.py --arena large.arenac
+#
+# This module does not depend on pygame.
+
+import argparse
+import os
+import struct
+import time
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+from world import BT, CT, Wall, WallMap, World, default_walls
+
+# An arena: its size, its walls (a list of 'Wall') and the places where
+# figures start (a list of (x, y)).  'wall_map' is the 'WallMap' of the walls
+# if it was loaded from a compiled arena, else None.
+Arena = namedtuple("Arena", "width height walls spawns wall_map", defaults=(None,))
+
+# Size of the arena of online games and of matches of bots (see net.py and
+# batch.py), and of the figures in it (in pixel)
+ARENA_W = 1000
+ARENA_H = 600
+FIGURE_SIZE = 50
+
+# Names of the types of walls in the text format
+WALL_TYPES = {"bottom": BT.Bottom, "top": BT.Top, "left": BT.Left, "right": BT.Right}
+
+MAGIC = b"ARENAMAP"
+VERSION = 1
+
+# A compiled arena starts with its size and the size of the figures for
+# which the grids were computed, then its walls and spawns follow
+HEADER = struct.Struct("<8sHdddII")        # magic, version, width, height, figure size, counts
+WALL = struct.Struct("<4dBddH")            # rect, type, x_rep, y_rep, length of the pattern
+SPAWN = struct.Struct("<dd")
+# Then the grids of the 'WallMap', compressed
+GRIDS = struct.Struct("<dd2d2I3III")       # cell sizes, origin, shapes, compressed lengths
+
+
+def default_arena(width, height, wall_width=50):
+    """Return the arena of the size of the window, surrounded by walls."""
+    return Arena(width, height, default_walls(width, height, wall_width),
+                 [(100, 100), (width - 100, height - 100)])
+
+
+def arena_wall(x, y, width, height, type_, pattern):
+    """Return a 'Wall' whose 'pattern' is spread along its whole length."""
+    if type_ in (BT.Top, BT.Bottom):
+        return Wall((x, y, width, height), type_, pattern, width / len(pattern), 0)
+    return Wall((x, y, width, height), type_, pattern, 0, height / len(pattern))
+
+
+def parse_arena(text, name="<arena>"):
+    """Return the arena described by 'text' (see the top of this module)."""
+    size = None
+    walls = []
+    spawns = []
+    for number, line in enumerate(text.splitlines(), 1):
+        words = line.split("#", 1)[0].split()
+        if not words:
+            continue
+        try:
+            if words[0] == "size" and len(words) == 3:
+                size = (float(words[1]), float(words[2]))
+            elif words[0] == "wall" and len(words) == 7:
+                x, y, width, height = (float(word) for word in words[1:5])
+                pattern = words[6]
+                if width <= 0 or height <= 0 or set(pattern) - set("-X"):
+                    raise ValueError
+                walls.append(arena_wall(x, y, width, height, WALL_TYPES[words[5]], pattern))
+            elif words[0] == "spawn" and len(words) == 3:
+                spawns.append((float(words[1]), float(words[2])))
+            else:
+                raise ValueError
+        except (KeyError, ValueError):
+            raise ValueError("{}, line {}: invalid item: {}".format(name, number, line.strip()))
+    if size is None:
+        raise ValueError("{}: the size of the arena is missing".format(name))
+    return Arena(size[0], size[1], walls, spawns)
+
+
+def format_arena(arena):
+    """Return the description of 'arena' as text."""
+    names = {type_: name for name, type_ in WALL_TYPES.items()}
+    lines = ["size {:g} {:g}".format(arena.width, arena.height)]
+    for wall in arena.walls:
+        lines.append("wall {:g} {:g} {:g} {:g} {} {}".format(
+            *wall.rect, names[wall.type_], wall.pattern))
+    for x, y in arena.spawns:
+        lines.append("spawn {:g} {:g}".format(x, y))
+    return "\n".join(lines) + "\n"
+
+
+def compile_arena(arena, path, figure_size):
+    """Write 'arena' into the file 'path' in the compiled form, with the
+    grids of the walls for figures of the diameter 'figure_size'."""
+    wall_map = arena.wall_map
+    if wall_map is None or wall_map.radius != figure_size / 2:
+        wall_map = WallMap(arena.walls, figure_size / 2)
+    data = [HEADER.pack(MAGIC, VERSION, arena.width, arena.height, figure_size,
+                        len(arena.walls), len(arena.spawns))]
+    for wall in arena.walls:
+        pattern = wall.pattern.encode("ascii")
+        data.append(WALL.pack(*tuple(wall.rect), wall.type_.value, wall.x_rep,
+                              wall.y_rep, len(pattern)) + pattern)
+    for spawn in arena.spawns:
+        data.append(SPAWN.pack(*spawn))
+    kind = zlib.compress(wall_map.kind.astype(np.uint8).tobytes())
+    near = zlib.compress(wall_map.near.astype("<i4").tobytes())
+    data.append(GRIDS.pack(wall_map.cell_size, wall_map.near_size, *wall_map.origin,
+                           *wall_map.kind.shape, *wall_map.near.shape, len(kind), len(near)))
+    data += [kind, near]
+    with open(path, "wb") as f:
+        f.write(b"".join(data))
+
+
+def _load_compiled(data, name):
+    try:
+        version = HEADER.unpack_from(data)[1]
+        arena = _parse_compiled(data) if version == VERSION else None
+    except (struct.error, zlib.error, ValueError):
+        raise ValueError("{}: the compiled arena is damaged".format(name))
+    if arena is None:
+        raise ValueError("{} was compiled by another version".format(name))
+    return arena
+
+
+def _parse_compiled(data):
+    (_, _, width, height, figure_size, n_walls, n_spawns) = HEADER.unpack_from(data)
+    offset = HEADER.size
+    walls = []
+    for _ in range(n_walls):
+        *rect, type_, x_rep, y_rep, length = WALL.unpack_from(data, offset)
+        offset += WALL.size
+        pattern = data[offset:offset + length].decode("ascii")
+        offset += length
+        walls.append(Wall(tuple(rect), BT(type_), pattern, x_rep, y_rep))
+    spawns = [SPAWN.unpack_from(data, offset + k * SPAWN.size) for k in range(n_spawns)]
+    offset += n_spawns * SPAWN.size
+    (cell_size, near_size, *origin, kind_w, kind_h, near_w, near_h, near_d,
+     kind_length, near_length) = GRIDS.unpack_from(data, offset)
+    offset += GRIDS.size
+    kind = np.frombuffer(zlib.decompress(data[offset:offset + kind_length]), dtype=np.uint8)
+    offset += kind_length
+    near = np.frombuffer(zlib.decompress(data[offset:offset + near_length]), dtype="<i4")
+    grids = (np.array(origin), kind.reshape(kind_w, kind_h),
+             near.reshape(near_w, near_h, near_d).astype(int))
+    wall_map = WallMap(walls, figure_size / 2, cell_size, near_size, grids=grids)
+    return Arena(width, height, walls, spawns, wall_map)
+
+
+def load_arena(path):
+    """Load the arena in the file 'path', either a description as text or a
+    compiled arena."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data.startswith(MAGIC):
+        return _load_compiled(data, path)
+    return parse_arena(data.decode("utf-8"), path)
+
+
+def arena_world(arena, figure_size, capacity=4):
+    """Return an empty world with the walls of 'arena', for figures of the
+    diameter 'figure_size'."""
+    return World(figure_size, arena.walls, capacity, arena.wall_map)
+
+
+def create_world():
+    """Return an empty world in the arena of online games and of matches of
+    bots, which is surrounded by walls."""
+    return arena_world(default_arena(ARENA_W, ARENA_H), FIGURE_SIZE)
+
+
+def generate_arena(width, height, n_walls, seed=0, wall_width=50):
+    """Return an arena of the given size, surrounded by walls, with 'n_walls'
+    randomly placed walls inside, a third of which have dangerous segments."""
+    rng = np.random.default_rng(seed)
+    walls = [
+        arena_wall(0, 0, wall_width, height, BT.Left, "-" * max(1, int(height // 200))),
+        arena_wall(width - wall_width, 0, wall_width, height, BT.Right,
+                   "-" * max(1, int(height // 200))),
+        arena_wall(0, height - wall_width, width, wall_width, BT.Bottom,
+                   "-" * max(1, int(width // 200))),
+        arena_wall(0, 0, width, wall_width, BT.Top, "-" * max(1, int(width // 200))),
+    ]
+    for k in range(n_walls):
+        segments = int(rng.integers(2, 13))
+        length = segments * wall_width
+        if k % 3 == 0:
+            pattern = "".join(rng.choice(["-", "X"], segments))
+        else:
+            pattern = "-" * segments
+        if rng.random() < 0.5:
+            x = rng.uniform(2 * wall_width, width - 2 * wall_width - length)
+            y = rng.uniform(2 * wall_width, height - 3 * wall_width)
+            walls.append(arena_wall(round(x), round(y), length, wall_width, BT.Top, pattern))
+        else:
+            x = rng.uniform(2 * wall_width, width - 3 * wall_width)
+            y = rng.uniform(2 * wall_width, height - 2 * wall_width - length)
+            walls.append(arena_wall(round(x), round(y), wall_width, length, BT.Left, pattern))
+    # Places to start, away from the walls
+    wall_map = WallMap(walls, 2 * wall_width)
+    spawns = []
+    for _ in range(1000):
+        if len(spawns) == 8:
+            break
+        pos = rng.uniform(2 * wall_width, (width - 2 * wall_width, height - 2 * wall_width))
+        if wall_map.classify(pos[None, :])[0] == CT.NoCollision.value:
+            spawns.append((round(pos[0]), round(pos[1])))
+    return Arena(width, height, walls, spawns)
+
+
+def main_arena():
+    parser = argparse.ArgumentParser(description="Create and compile arenas.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compile_parser = commands.add_parser("compile", help="compile an arena for fast loading")
+    compile_parser.add_argument("path", help="description of the arena")
+    compile_parser.add_argument("-o", "--output",
+                                help="compiled arena (default: PATH with the ending .arenac)")
+    compile_parser.add_argument("--figure-size", type=float, default=50,
+                                help="diameter of the figures (default: 50)")
+    generate_parser = commands.add_parser("generate", help="generate a random arena")
+    generate_parser.add_argument("width", type=float)
+    generate_parser.add_argument("height", type=float)
+    generate_parser.add_argument("--walls", type=int, default=100,
+                                 help="number of walls inside (default: 100)")
+    generate_parser.add_argument("--seed", type=int, default=0)
+    generate_parser.add_argument("-o", "--output", required=True,
+                                 help="file for the description of the arena")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        arena = generate_arena(args.width, args.height, args.walls, args.seed)
+        with open(args.output, "w") as f:
+            f.write(format_arena(arena))
+        return
+    output = args.output or os.path.splitext(args.path)[0] + ".arenac"
+    start = time.perf_counter()
+    arena = load_arena(args.path)
+    arena = arena._replace(wall_map=WallMap(arena.walls, args.figure_size / 2))
+    source_time = time.perf_counter() - start
+    # The grids just computed are written
+    compile_arena(arena, output, args.figure_size)
+    start = time.perf_counter()
+    load_arena(output)
+    compiled_time = time.perf_counter() - start
+    print("{}: {} walls, loaded in {:.1f} ms from the description, in {:.1f} ms compiled"
+          .format(output, len(arena.walls), 1e3 * source_time, 1e3 * compiled_time))
+
+
+if __name__ == "__main__":
+    main_arena()
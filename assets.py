@@ -0,0 +1,117 @@
+# Cache of the images and fonts of the game.
+#
+# Every file is loaded only once, when it is used for the first time, and
+# the loaded surface is shared by everyone using it.  Images are converted to
+# the pixel format of the display, such that blitting them does not need a
+# conversion every time.  Since this is only possible after the display mode
+# has been set, images loaded before are converted when they are requested
+# again later.
+#
+# The game is drawn in units of the world, which are scaled to the window
+# (see 'set_scale').  Images are scaled once per scale and kept in a cache
+# of limited size, of which the least recently used images are dropped, so
+# drawing in any size costs the same as in the original size.
+
+import math
+from collections import OrderedDict
+
+import pygame
+
+_images = {}
+_fonts = {}
+# Scaled images: (key, scale) -> (surface, converted), in order of their use
+_scaled = OrderedDict()
+_scale = 1.0
+
+# Maximal number of scaled images kept
+max_scaled = 256
+
+
+def _display_ready():
+    return pygame.display.get_init() and pygame.display.get_surface() is not None
+
+
+def set_scale(scale):
+    """Scale all images loaded from now on by 'scale' (pixels of the window
+    per unit of the world)."""
+    global _scale
+    _scale = scale
+
+
+def get_scale():
+    return _scale
+
+
+def _load(path):
+    image, converted = _images.get(path, (None, False))
+    if image is None:
+        image = pygame.image.load(path)
+    if not converted and _display_ready():
+        image = image.convert_alpha()
+        converted = True
+    _images[path] = (image, converted)
+    return image
+
+
+def _load_flipped(path, flip_x, flip_y):
+    key = (path, flip_x, flip_y)
+    image, converted = _images.get(key, (None, False))
+    if image is None or (not converted and _display_ready()):
+        image = pygame.transform.flip(_load(path), flip_x, flip_y)
+        converted = _display_ready()
+        _images[key] = (image, converted)
+    return image
+
+
+def _scaled_image(key, image, size):
+    # Return 'image' with the size 'size' (in units of the world) scaled
+    if size is None:
+        size = image.get_size()
+    if _scale == 1 and tuple(size) == image.get_size():
+        return image
+    key = (key, tuple(size), _scale)
+    scaled, converted = _scaled.get(key, (None, False))
+    if scaled is None or (not converted and _display_ready()):
+        # Round up, such that tiles drawn next to each other leave no gaps
+        pixels = (max(1, math.ceil(size[0] * _scale)), max(1, math.ceil(size[1] * _scale)))
+        scaled = pygame.transform.smoothscale(image, pixels)
+        _scaled[key] = (scaled, _display_ready())
+        if len(_scaled) > max_scaled:
+            _scaled.popitem(last=False)
+    _scaled.move_to_end(key)
+    return scaled
+
+
+def load_image(path, size=None):
+    """Return the image stored in 'path' (with transparency), scaled to the
+    window.  'size' is the size of the image in units of the world (by
+    default the size of the file)."""
+    return _scaled_image(path, _load(path), size)
+
+
+def load_flipped_image(path, flip_x=True, flip_y=False, size=None):
+    """Return the image stored in 'path', mirrored and scaled to the window."""
+    return _scaled_image((path, flip_x, flip_y), _load_flipped(path, flip_x, flip_y), size)
+
+
+def image_size(path):
+    """Return the size of the image stored in 'path' in units of the world."""
+    return _load(path).get_size()
+
+
+def load_font(path, size):
+    """Return the font stored in 'path' (None for the default font)."""
+    key = (path, size)
+    if key not in _fonts:
+        # The fonts of pygame are started only when the first one is needed
+        if not pygame.font.get_init():
+            pygame.font.init()
+        _fonts[key] = pygame.font.Font(path, size)
+    return _fonts[key]
+
+
+def clear():
+    """Forget all loaded images and fonts, e.g. after changing the display."""
+    _images.clear()
+    _scaled.clear()
+    _fonts.clear()
@@ -0,0 +1,321 @@
+#! /usr/bin/env python3
+#
+# Many headless matches at once: a batch runner for independent matches of
+# bots and a vectorized environment in the style of gym, e.g. to tune the
+# constants of the world or to train and evaluate controllers.
+#
+# Matches need neither a window nor pygame.  The batch runner spreads them
+# over a pool of processes.  The environment advances N arenas with one call
+# of 'step' and returns the observations of all of them as one NumPy array;
+# 'ParallelVecEnv' distributes the arenas over worker processes.
+#
+# Usage:
+#     python3 batch.py run [-m 1000] [--figures 2] [--set acceleration=800]
+#     python3 batch.py scaling [-m 64] [--workers 1 2 4]
+
+import argparse
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ai import BotController
+from arena import ARENA_H, ARENA_W, create_world
+from world import FixedTimestep, World
+
+# A match of 'n_figures' bots, placed at random with the generator seeded
+# with 'seed', in a world with the constants 'params' (a dictionary, see
+# World.parameters), lasting at most 'max_time' seconds
+Match = namedtuple("Match", "seed n_figures params max_time", defaults=(2, None, 60.0))
+
+# The result of a match: the index of the last surviving figure (-1 if
+# there is none or the time was over), the number of steps, the duration in
+# seconds and the number of figures still alive
+MatchResult = namedtuple("MatchResult", "seed winner ticks time survivors")
+
+# The features of every figure in an observation of 'VecEnv'
+FEATURES = ("x", "y", "vx", "vy", "alive", "dizzy")
+
+
+def create_match(n_figures, rng, params=None):
+    """Create a world with 'n_figures' figures at random free places.
+    'rng' is a NumPy random generator, 'params' changes constants of the
+    world."""
+    world = create_world()
+    for name, value in (params or {}).items():
+        if name not in World.parameters:
+            raise ValueError("Unknown parameter of the world: {}".format(name))
+        setattr(world, name, value)
+    margin = world.size
+    for _ in range(n_figures):
+        pos = world.free_place(rng, (margin, margin), (ARENA_W - margin, ARENA_H - margin))
+        # The arrays of the world may grow when a figure is added
+        index = world.add_figure()
+        world.pos[index] = pos
+    return world
+
+
+def run_match(match, dt=1/120):
+    """Play a 'Match' of bots, until at most one figure survived or the time
+    is over.  Return a 'MatchResult'."""
+    world = create_match(match.n_figures, np.random.default_rng(match.seed), match.params)
+    bots = BotController(world, np.arange(world.n))
+    simulation = FixedTimestep(world, dt)
+    max_ticks = int(round(match.max_time / dt))
+    while world.tick < max_ticks and np.count_nonzero(world.alive[:world.n]) > 1:
+        simulation.run(1, bots.update)
+    survivors = np.nonzero(world.alive[:world.n])[0]
+    winner = int(survivors[0]) if len(survivors) == 1 else -1
+    return MatchResult(match.seed, winner, world.tick, world.time, len(survivors))
+
+
+def run_matches(matches, workers=None):
+    """Run all 'matches' on a pool of 'workers' processes (by default one per
+    core) and return their results in the same order."""
+    matches = list(matches)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return [run_match(match) for match in matches]
+    # Several matches per task, to keep the overhead of the pool small, but
+    # enough tasks to balance the load between the processes
+    chunksize = max(1, len(matches) // (4 * workers))
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(run_match, matches, chunksize=chunksize))
+
+
+def _seed_sequences(seed, n):
+    # Independent random streams for 'n' arenas; a list of sequences is
+    # used as it is (see ParallelVecEnv)
+    if isinstance(seed, list):
+        return seed
+    return np.random.SeedSequence(seed).spawn(n)
+
+
+class VecEnv:
+    """Environment of 'n_envs' independent arenas, in the style of gym.
+
+    In every arena, figure 0 is controlled by the agent, the other figures
+    are bots chasing the nearest figure.  The action for an arena is
+    (dx, dy, boost): the direction of the figure and whether the booster is
+    activated (if boost > 0.5).  Every action is applied for 'frame_skip'
+    steps of the world of 'dt' seconds.
+
+    Observations are arrays of shape (n_envs, n_figures, len(FEATURES)).
+    The reward is the number of bots that died during the step, minus 1 if
+    the figure of the agent died.  An episode is done when the figure of the
+    agent or all bots died or after 'max_time' seconds; the arena is then
+    reset, and the observation returned is the first one of the new episode
+    (the last one of the old episode is in the info of the arena).
+    """
+
+    def __init__(self, n_envs, n_figures=2, params=None, frame_skip=4, dt=1/120,
+                 max_time=60.0, seed=None):
+        self.n_envs = n_envs
+        self.n_figures = n_figures
+        self.params = params
+        self.frame_skip = frame_skip
+        self.dt = dt
+        self.max_ticks = int(round(max_time / dt))
+        self.observation_shape = (n_envs, n_figures, len(FEATURES))
+        self._seed(seed)
+        self.worlds = [None] * n_envs
+        self.bots = [None] * n_envs
+
+    def _seed(self, seed):
+        self.rngs = [np.random.default_rng(s)
+                     for s in _seed_sequences(seed, self.n_envs)]
+
+    def _reset_arena(self, k):
+        world = create_match(self.n_figures, self.rngs[k], self.params)
+        self.worlds[k] = world
+        self.bots[k] = BotController(world, np.arange(1, world.n))
+
+    def reset(self, seed=None):
+        """Start new episodes in all arenas and return the observations."""
+        if seed is not None:
+            self._seed(seed)
+        for k in range(self.n_envs):
+            self._reset_arena(k)
+        return self.observe()
+
+    def observe(self):
+        obs = np.zeros(self.observation_shape, dtype=np.float32)
+        for k, world in enumerate(self.worlds):
+            n = world.n
+            obs[k, :, 0:2] = world.pos[:n]
+            obs[k, :, 2:4] = world.heading[:n] * world.speed[:n, None]
+            obs[k, :, 4] = world.alive[:n]
+            obs[k, :, 5] = world.dizzy[:n]
+        return obs
+
+    def step(self, actions):
+        """Apply one action per arena.  Return the observations, the rewards,
+        whether the episodes are done, and a list of dictionaries with
+        additional information per arena."""
+        actions = np.asarray(actions, dtype=float).reshape(self.n_envs, 3)
+        rewards = np.zeros(self.n_envs, dtype=np.float32)
+        dones = np.zeros(self.n_envs, dtype=bool)
+        infos = [{} for _ in range(self.n_envs)]
+        finished = []
+        for k, world in enumerate(self.worlds):
+            bots = self.bots[k]
+            alive_before = world.alive[:world.n].copy()
+            world.direction[0] = actions[k, :2]
+            if actions[k, 2] > 0.5:
+                world.activate_boost(0)
+            for _ in range(self.frame_skip):
+                bots.update()
+                world.step(self.dt)
+            alive = world.alive[:world.n]
+            died = alive_before & ~alive
+            rewards[k] = np.count_nonzero(died[1:]) - float(died[0])
+            dones[k] = (not alive[0] or not alive[1:].any()
+                        or world.tick >= self.max_ticks)
+            if dones[k]:
+                finished.append(k)
+        if finished:
+            last = self.observe()
+            for k in finished:
+                infos[k]["final_observation"] = last[k]
+                infos[k]["ticks"] = self.worlds[k].tick
+                self._reset_arena(k)
+        return self.observe(), rewards, dones, infos
+
+    def close(self):
+        pass
+
+
+def _vec_env_worker(connection, n_envs, kwargs):
+    # Serve the commands of a ParallelVecEnv for a part of its arenas
+    env = VecEnv(n_envs, **kwargs)
+    while True:
+        command, argument = connection.recv()
+        if command == "reset":
+            connection.send(env.reset(argument))
+        elif command == "step":
+            connection.send(env.step(argument))
+        elif command == "close":
+            connection.close()
+            return
+
+
+class ParallelVecEnv:
+    """Like 'VecEnv', but with the arenas distributed over 'workers'
+    processes (by default one per core).  With the same seed, the results
+    are the same as those of a 'VecEnv'."""
+
+    def __init__(self, n_envs, workers=None, seed=None, **kwargs):
+        self.n_envs = n_envs
+        workers = min(workers or os.cpu_count() or 1, n_envs)
+        # The arenas of every worker, as slices
+        bounds = np.linspace(0, n_envs, workers + 1).round().astype(int)
+        self.slices = [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+        self.connections = []
+        self.processes = []
+        seeds = _seed_sequences(seed, n_envs)
+        for part in self.slices:
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_vec_env_worker, daemon=True,
+                args=(child, part.stop - part.start, dict(kwargs, seed=seeds[part])))
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    def reset(self, seed=None):
+        seeds = _seed_sequences(seed, self.n_envs) if seed is not None else None
+        for part, connection in zip(self.slices, self.connections):
+            connection.send(("reset", None if seeds is None else seeds[part]))
+        return np.concatenate([connection.recv() for connection in self.connections])
+
+    def step(self, actions):
+        actions = np.asarray(actions, dtype=float).reshape(self.n_envs, 3)
+        for part, connection in zip(self.slices, self.connections):
+            connection.send(("step", actions[part]))
+        results = [connection.recv() for connection in self.connections]
+        obs = np.concatenate([r[0] for r in results])
+        rewards = np.concatenate([r[1] for r in results])
+        dones = np.concatenate([r[2] for r in results])
+        infos = [info for r in results for info in r[3]]
+        return obs, rewards, dones, infos
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(("close", None))
+            connection.close()
+        for process in self.processes:
+            process.join()
+
+
+def _parse_params(assignments):
+    params = {}
+    for assignment in assignments:
+        name, _, value = assignment.partition("=")
+        params[name] = float(value)
+    return params
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many headless matches of bots.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run matches and summarize the results")
+    run.add_argument("-m", "--matches", type=int, default=1000)
+    run.add_argument("-f", "--figures", type=int, default=2, help="figures per match")
+    run.add_argument("--max-time", type=float, default=60.0,
+                     help="maximal duration of a match in seconds")
+    run.add_argument("--set", nargs="+", default=[], metavar="NAME=VALUE",
+                     help="constants of the world, out of: {}".format(
+                         ", ".join(World.parameters)))
+    run.add_argument("--workers", type=int, help="number of processes (default: cores)")
+    scaling = commands.add_parser("scaling", help="measure the throughput per number of processes")
+    scaling.add_argument("-m", "--matches", type=int, default=64)
+    scaling.add_argument("--max-time", type=float, default=10.0)
+    scaling.add_argument("--workers", type=int, nargs="+",
+                         default=sorted({1, 2, os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    if args.command == "run":
+        params = _parse_params(args.set)
+        for name in params:
+            if name not in World.parameters:
+                parser.error("unknown constant: {}".format(name))
+        matches = [Match(seed, args.figures, params, args.max_time)
+                   for seed in range(args.matches)]
+        start = time.perf_counter()
+        results = run_matches(matches, args.workers)
+        duration = time.perf_counter() - start
+        decided = [r for r in results if r.winner >= 0]
+        print("{} matches in {:.2f} s ({:.1f} per second)".format(
+            len(results), duration, len(results) / duration))
+        print("decided: {}, mean duration: {:.2f} s of game".format(
+            len(decided), np.mean([r.time for r in results])))
+        wins = np.bincount([r.winner for r in decided], minlength=args.figures)
+        print("wins per starting figure: {}".format(" ".join(map(str, wins))))
+    else:
+        print("{:>8} {:>14} {:>12} {:>18}".format(
+            "workers", "matches per s", "speedup", "env steps per s"))
+        base = None
+        for workers in args.workers:
+            matches = [Match(seed, 2, None, args.max_time) for seed in range(args.matches)]
+            start = time.perf_counter()
+            run_matches(matches, workers)
+            rate = args.matches / (time.perf_counter() - start)
+            base = base or rate
+            # The vectorized environment with 16 arenas per process
+            env = ParallelVecEnv(16 * workers, workers, seed=0)
+            env.reset()
+            actions = np.zeros((env.n_envs, 3))
+            start = time.perf_counter()
+            for _ in range(50):
+                env.step(actions)
+            steps = 50 * env.n_envs / (time.perf_counter() - start)
+            env.close()
+            print("{:8d} {:14.1f} {:11.2f}x {:18.0f}".format(workers, rate, rate / base, steps))
+
+
+if __name__ == "__main__":
+    main()
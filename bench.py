@@ -0,0 +1,615 @@
+#! /usr/bin/env python3
+#
+# Benchmarks for the hot paths of the game: simulation, collision detection
+# and rendering.
+#
+# The benchmarks run without a window (with SDL's dummy video driver).  Every
+# case is run for a number of iterations, and the timing of every iteration is
+# recorded.  The results are printed as a table, and can be written as JSON to
+# compare them between commits:
+#
+#     python3 bench.py --json before.json
+#     ... (change something)
+#     python3 bench.py --json after.json --compare before.json
+#
+# The cost of the collision detection per step, as the number of figures
+# grows (at the same density), is measured with:
+#
+#     python3 bench.py --scaling
+#
+# See 'python3 bench.py --help' for the available options.
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy as np
+import pygame
+
+import assets
+import main
+from ai import BotController
+from arena import (arena_world, compile_arena, default_arena, format_arena,
+                   generate_arena, load_arena, parse_arena)
+from rollback import Rollback
+from world import BT, CT, Wall, WallMap, World
+
+# Area of the open arena per figure (in pixel^2), see 'open_world'
+AREA_PER_FIGURE = 200**2
+
+
+def open_world(n_figures, speed, n_obstacles=0, seed=0):
+    """Create a world with randomly placed figures moving at 'speed'.
+
+    The arena grows with the number of figures, such that the density of
+    figures stays the same.  It is surrounded by harmless walls and contains
+    'n_obstacles' small walls, a third of which are deadly.
+    """
+    rng = np.random.default_rng(seed)
+    side = np.sqrt(n_figures * AREA_PER_FIGURE)
+    width = main.PLAYER_SIZE
+    walls = [
+        Wall((-width, -width, width, side + 2*width), BT.Left, "-", 0, side),
+        Wall((side, -width, width, side + 2*width), BT.Right, "-", 0, side),
+        Wall((-width, -width, side + 2*width, width), BT.Top, "-", side, 0),
+        Wall((-width, side, side + 2*width, width), BT.Bottom, "-", side, 0),
+    ]
+    for k in range(n_obstacles):
+        x, y = rng.uniform(0, side - 20, 2)
+        walls.append(Wall((x, y, 20, 20), BT.Top if k % 2 else BT.Left,
+                          "X" if k % 3 == 0 else "-", 20, 0))
+    world = World(main.PLAYER_SIZE, walls, capacity=n_figures)
+    world.normalspeed = speed
+    for _ in range(n_figures):
+        world.add_figure()
+    margin = main.PLAYER_SIZE
+    world.pos[:n_figures] = rng.uniform(margin, side - margin, (n_figures, 2))
+    angle = rng.uniform(0, 2*np.pi, n_figures)
+    world.direction[:n_figures] = np.stack((np.cos(angle), np.sin(angle)), axis=1)
+    world.heading[:n_figures] = world.direction[:n_figures]
+    world.speed[:n_figures] = speed
+    return world
+
+
+_large_arena = []
+
+
+def large_arena():
+    """Return a large arena (16 times the area of the window in each
+    direction) with 2000 walls inside, generated once."""
+    if not _large_arena:
+        _large_arena.append(generate_arena(16000, 9600, 2000))
+    return _large_arena[0]
+
+
+_temp = []
+
+
+def _temp_dir():
+    # A directory for files of the cases, removed at the end
+    if not _temp:
+        _temp.append(tempfile.TemporaryDirectory())
+    return _temp[0].name
+
+
+def place_figures(world, n_figures, lo, hi, rng):
+    """Add 'n_figures' figures at random places within [lo, hi] outside of
+    the walls (but maybe overlapping each other)."""
+    for _ in range(n_figures):
+        world.add_figure()
+    pos = world.pos[:n_figures]
+    blocked = np.ones(n_figures, dtype=bool)
+    while blocked.any():
+        pos[blocked] = rng.uniform(lo, hi, (np.count_nonzero(blocked), 2))
+        blocked = world.colcont.check_walls(pos) != CT.NoCollision.value
+
+
+def open_arena_world(n_figures, speed, seed=0):
+    """Like 'open_world', with the figures at the same density, but around
+    the centre of the large arena with its many walls."""
+    rng = np.random.default_rng(seed)
+    arena = large_arena()
+    world = arena_world(arena, main.PLAYER_SIZE, capacity=n_figures)
+    world.normalspeed = speed
+    size = np.array([arena.width, arena.height])
+    side = np.sqrt(n_figures * AREA_PER_FIGURE)
+    lo = np.maximum(size/2 - side/2, main.PLAYER_SIZE)
+    hi = np.minimum(size/2 + side/2, size - main.PLAYER_SIZE)
+    place_figures(world, n_figures, lo, hi, rng)
+    angle = rng.uniform(0, 2*np.pi, n_figures)
+    world.direction[:n_figures] = np.stack((np.cos(angle), np.sin(angle)), axis=1)
+    world.heading[:n_figures] = world.direction[:n_figures]
+    world.speed[:n_figures] = speed
+    return world
+
+
+class Scene:
+    """The game as drawn on screen, with 'n_figures' figures in the 'arena'
+    (by default the arena of the size of the window), in a window of the
+    size 'window_size' (by default the original size).  The figures are
+    placed around the centre of the arena, apart from each other (at the
+    density of 'open_world' if they do not fit into the window), and the
+    camera follows the first one."""
+
+    def __init__(self, n_figures, speed, seed=0, window_size=None, arena=None):
+        rng = np.random.default_rng(seed)
+        arena = arena or default_arena(main.SCREEN_W, main.SCREEN_H)
+        self.window = pygame.display.set_mode(window_size or [main.SCREEN_W, main.SCREEN_H])
+        self.view = main.Camera((arena.width, arena.height), self.window.get_size())
+        assets.set_scale(self.view.scale)
+        self.walls = [main.Border(wall) for wall in arena.walls]
+        self.background_layers = main.create_background()
+        self.world = arena_world(arena, main.PLAYER_SIZE, capacity=n_figures)
+        self.world.normalspeed = speed
+        self.figures = []
+        size = np.array([arena.width, arena.height])
+        half = np.maximum((main.SCREEN_W/2 - 100, main.SCREEN_H/2 - 100),
+                          np.sqrt(n_figures * AREA_PER_FIGURE) / 2)
+        lo = np.maximum(size/2 - half, main.PLAYER_SIZE)
+        hi = np.minimum(size/2 + half, size - main.PLAYER_SIZE)
+        for k in range(n_figures):
+            # Overlapping figures would be stuck in collisions with each other
+            pos = self.world.free_place(rng, lo, hi, tries=1000)
+            figure = main.Figure(*main.CHARACTERS[k % main.N_CHARACTERS], self.world)
+            figure.set_centre(pos)
+            angle = rng.uniform(0, 2*np.pi)
+            figure.direction = (np.cos(angle), np.sin(angle))
+            self.figures.append(figure)
+        self.joystick = main.Joystick()
+        self.joystick.activate((200, 400))
+        self.joystick.set_direction((230, 380))
+        self.fps_text = assets.load_font(None, 20).render("FPS: 0", 1, main.BLACK)
+        self.renderer = main.Renderer(self.window, self.walls, self.background_layers,
+                                      self.view)
+
+    def get_sprites(self):
+        """Return the sprites of the figures in sight and of the HUD."""
+        if self.figures:
+            self.view.follow(self.world.pos[self.figures[0].index])
+        visible = self.view.visible(self.world.pos[:self.world.n], main.PLAYER_SIZE)
+        sprites = []
+        for figure in self.figures:
+            if visible[figure.index]:
+                sprites += figure.get_sprites()
+        hud = ([(surface, self.view.to_screen(pos, fixed=True))
+                for surface, pos in self.joystick.get_sprites()]
+               + [(self.fps_text, (0, 0))])
+        return sprites, hud
+
+    def frame(self):
+        """Do everything the main loop does for one frame."""
+        self.world.step(1/60)
+        for layer in self.background_layers:
+            layer.update(1/60)
+        pygame.display.update(self.renderer.draw(*self.get_sprites()))
+
+    def frame_full(self):
+        """Like 'frame', but redraw and update the whole window."""
+        self.world.step(1/60)
+        for layer in self.background_layers:
+            layer.update(1/60)
+        sprites, hud = self.get_sprites()
+        main.draw_background(self.window, self.walls, self.background_layers, self.view)
+        self.window.blits([(surface, self.view.to_screen(pos)) for surface, pos in sprites])
+        self.window.blits(hud)
+        pygame.display.flip()
+
+
+# Benchmark cases: each function takes the number of figures and their speed
+# and returns a function doing one iteration (one tick or one frame), or None
+# if the case is not run for these parameters.
+
+def case_world_step(n_figures, speed):
+    world = open_world(n_figures, speed)
+    return (lambda: world.step(1/120))
+
+
+def case_world_step_arena(n_figures, speed):
+    # The same figures in the large arena, which should cost about the same
+    world = open_arena_world(n_figures, speed)
+    return (lambda: world.step(1/120))
+
+
+def case_player_impacts(n_figures, speed):
+    world = open_world(n_figures, speed)
+    n = world.n
+    vel = world.heading[:n] * world.speed[:n, None]
+    return (lambda: world.colcont.player_impacts(world.pos[:n], vel,
+                                                 world.alive[:n], 1/120))
+
+
+def case_player_impacts_all_pairs(n_figures, speed):
+    if n_figures > 1000:
+        return None
+    world = open_world(n_figures, speed)
+    world.colcont.broadphase_min = n_figures + 1
+    n = world.n
+    vel = world.heading[:n] * world.speed[:n, None]
+    return (lambda: world.colcont.player_impacts(world.pos[:n], vel,
+                                                 world.alive[:n], 1/120))
+
+
+def case_bots(n_figures, speed):
+    # All figures are bots, chasing each other
+    world = open_world(n_figures, speed)
+    bots = BotController(world, np.arange(n_figures))
+    return bots.update
+
+
+def case_bots_budget(n_figures, speed):
+    # All bots would like to think in every step, but only think for about
+    # half a millisecond per step; the others keep their plans longer
+    world = open_world(n_figures, speed)
+    bots = BotController(world, np.arange(n_figures), think_every=1, budget=0.0005)
+    return bots.update
+
+
+def rollback_world(n_figures, speed, depth):
+    """Return a world of bots and a 'Rollback' which kept its last 'depth'
+    steps."""
+    world = open_world(n_figures, speed)
+    bots = BotController(world, np.arange(n_figures))
+    rollback = Rollback(world, 1/120, depth + 1)
+    for _ in range(depth):
+        bots.update()
+        rollback.step()
+    return world, rollback
+
+
+def case_save_state(n_figures, speed):
+    world, rollback = rollback_world(n_figures, speed, 1)
+    return rollback.save
+
+
+def case_restore_state(n_figures, speed):
+    world, rollback = rollback_world(n_figures, speed, 1)
+    tick = world.tick
+    return lambda: rollback.restore(tick)
+
+
+def case_rollback(depth):
+    # Going back 'depth' steps and simulating them again, as when the
+    # inputs of a remote player arrive that late; the time of a frame
+    # (16.7 ms at 60 frames per second) limits how far a client can go back
+    def case(n_figures, speed):
+        world, rollback = rollback_world(n_figures, speed, depth)
+        tick = world.tick - depth
+        return lambda: rollback.resimulate(tick)
+    return case
+
+
+def case_check_collision(n_figures, speed):
+    # Check every figure once, as needed per tick
+    world = open_world(n_figures, speed)
+    check = world.colcont.check_collision
+
+    def iteration():
+        for index in range(n_figures):
+            check(index)
+    return iteration
+
+
+def case_classify_walls(n_figures, speed):
+    # Classify the position of every figure with respect to the walls
+    world = World(main.PLAYER_SIZE, main.create_walls())
+    rng = np.random.default_rng(0)
+    points = rng.uniform((0, 0), (main.SCREEN_W, main.SCREEN_H), (n_figures, 2))
+    return lambda: world.colcont.check_walls(points)
+
+
+def case_wall_impacts(n_figures, speed):
+    # As many small walls as figures in the arena
+    world = open_world(n_figures, speed, n_obstacles=n_figures)
+    n = world.n
+    vel = world.heading[:n] * world.speed[:n, None]
+    return (lambda: world.colcont.wall_impacts(world.pos[:n], vel,
+                                               world.alive[:n], 1/120))
+
+
+def case_load_arena(n_figures, speed):
+    # Load the large arena from its compiled form
+    path = os.path.join(_temp_dir(), "large.arenac")
+    compile_arena(large_arena(), path, main.PLAYER_SIZE)
+    return (lambda: load_arena(path))
+
+
+def case_parse_arena(n_figures, speed):
+    # Load the large arena from its description, including the grids of the
+    # walls computed for its world
+    text = format_arena(large_arena())
+    return (lambda: WallMap(parse_arena(text).walls, main.PLAYER_SIZE / 2))
+
+
+def case_draw_background(n_figures, speed):
+    scene = Scene(0, speed)
+    return (lambda: main.draw_background(scene.window, scene.walls,
+                                         scene.background_layers))
+
+
+def case_wave_draw(n_figures, speed):
+    scene = Scene(0, speed)
+
+    def iteration():
+        for layer in scene.background_layers:
+            layer.update(1/60)
+            layer.draw(scene.window)
+    return iteration
+
+
+def case_user_input(n_figures, speed):
+    # Dragging the joystick around with the mouse, one motion per iteration
+    scene = Scene(1, speed)
+    figure = scene.figures[0]
+    control = main.UserControl(scene.joystick, scene.view)
+    control.handle(pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=(200, 400), button=1),
+                   figure)
+    events = [pygame.event.Event(pygame.MOUSEMOTION, pos=(200 + 60*np.cos(angle),
+                                                         400 + 60*np.sin(angle)))
+              for angle in np.linspace(0, 2*np.pi, 60)]
+
+    def iteration():
+        for event in events:
+            control.handle(event, figure)
+            scene.joystick.get_sprites()
+    return iteration
+
+
+def case_frame(n_figures, speed):
+    scene = Scene(n_figures, speed)
+    return scene.frame
+
+
+def case_frame_full(n_figures, speed):
+    scene = Scene(n_figures, speed)
+    return scene.frame_full
+
+
+def case_frame_arena(n_figures, speed):
+    # The camera follows a figure through the large arena, so the whole
+    # window is drawn anew in every frame, but only what is in sight
+    scene = Scene(n_figures, speed, arena=large_arena())
+    return scene.frame
+
+
+def case_frame_scaled(n_figures, speed):
+    # The arena scaled up to a larger window: since the images are scaled
+    # once when they are loaded, a frame should cost about the same as in the
+    # original size, apart from the larger area of the window
+    scene = Scene(n_figures, speed, window_size=[1500, 900])
+    return scene.frame
+
+
+def run_python(code):
+    """Return an iteration running 'code' in a new Python process, such that
+    the time from starting the program on is measured.  The process ends
+    right after 'code', without the time Python needs to shut down."""
+    def iteration():
+        subprocess.run([sys.executable, "-c", code + "\nimport os\nos._exit(0)"],
+                       check=True, stdout=subprocess.DEVNULL)
+    return iteration
+
+
+def case_startup_python(n_figures, speed):
+    # Starting Python alone, which the other startup cases include
+    return run_python("pass")
+
+
+def case_startup_headless(n_figures, speed):
+    # What headless tools (batches, servers, replays) import, without pygame
+    return run_python("import sys, arena, batch, net, replay, world\n"
+                      "assert 'pygame' not in sys.modules")
+
+
+def case_startup_import_game(n_figures, speed):
+    # Importing the game as a library, without starting it
+    return run_python("import main")
+
+
+def case_startup_first_frame(n_figures, speed):
+    # Starting the game until its first frame (the selection of the
+    # character) is shown
+    return run_python("import os, pygame\n"
+                      "pygame.display.flip = lambda: os._exit(0)\n"
+                      "import main\n"
+                      "main.main([])")
+
+
+CASES = {
+    "world_step": case_world_step,
+    "world_step_arena": case_world_step_arena,
+    "player_impacts": case_player_impacts,
+    "player_impacts_all_pairs": case_player_impacts_all_pairs,
+    "bots": case_bots,
+    "bots_budget": case_bots_budget,
+    "check_collision": case_check_collision,
+    "save_state": case_save_state,
+    "restore_state": case_restore_state,
+    "rollback_1": case_rollback(1),
+    "rollback_8": case_rollback(8),
+    "rollback_30": case_rollback(30),
+    "classify_walls": case_classify_walls,
+    "wall_impacts": case_wall_impacts,
+    "load_arena": case_load_arena,
+    "parse_arena": case_parse_arena,
+    "draw_background": case_draw_background,
+    "wave_draw": case_wave_draw,
+    "user_input": case_user_input,
+    "frame": case_frame,
+    "frame_full": case_frame_full,
+    "frame_scaled": case_frame_scaled,
+    "frame_arena": case_frame_arena,
+    "startup_python": case_startup_python,
+    "startup_headless": case_startup_headless,
+    "startup_import_game": case_startup_import_game,
+    "startup_first_frame": case_startup_first_frame,
+}
+
+# Numbers of figures and cases for '--scaling'
+SCALING_FIGURES = [100, 300, 1000, 3000]
+SCALING_CASES = ["world_step"]
+
+# Cases which do not depend on the number of figures
+FIXED_CASES = {"load_arena", "parse_arena", "draw_background", "wave_draw", "user_input",
+               "startup_python", "startup_headless", "startup_import_game",
+               "startup_first_frame"}
+
+
+def measure(iteration, min_time, min_iterations, warmup=3):
+    """Run 'iteration' repeatedly and return the durations (in seconds)."""
+    for _ in range(warmup):
+        iteration()
+    durations = []
+    start = time.perf_counter()
+    while (len(durations) < min_iterations
+           or time.perf_counter() - start < min_time):
+        t0 = time.perf_counter()
+        iteration()
+        durations.append(time.perf_counter() - t0)
+    return np.array(durations)
+
+
+def measure_memory(iteration, iterations=20):
+    """Return the mean peak of the memory (in bytes) allocated by
+    'iteration' on top of the memory in use before.  Temporary objects
+    taken from the free lists of Python (e.g. floats) are not counted."""
+    iteration()
+    peaks = []
+    tracemalloc.start()
+    for _ in range(iterations):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        iteration()
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return float(np.mean(peaks))
+
+
+def summarize(name, n_figures, speed, durations, memory=None):
+    result = {
+        "case": name,
+        "figures": n_figures,
+        "speed": speed,
+        "iterations": len(durations),
+        "mean_ms": 1e3 * durations.mean(),
+        "p50_ms": 1e3 * np.percentile(durations, 50),
+        "p90_ms": 1e3 * np.percentile(durations, 90),
+        "p99_ms": 1e3 * np.percentile(durations, 99),
+        "max_ms": 1e3 * durations.max(),
+        "per_second": 1 / durations.mean(),
+    }
+    if memory is not None:
+        result["memory_kb"] = memory / 1e3
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pygame": pygame.version.ver,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+
+def print_results(results, reference=None, per_figure=False):
+    ref = {}
+    if reference is not None:
+        for r in reference["results"]:
+            ref[r["case"], r["figures"], r["speed"]] = r
+    memory = any("memory_kb" in r for r in results)
+    print("{:<26} {:>7} {:>6} {:>10} {:>10} {:>10} {:>12}{}{}{}".format(
+        "case", "figures", "speed", "p50 [ms]", "p90 [ms]", "p99 [ms]",
+        "per second", "  memory [kB]" if memory else "",
+        "  per figure [us]" if per_figure else "", "   speedup" if ref else ""))
+    for r in results:
+        line = "{case:<26} {figures:7d} {speed:6.0f} {p50_ms:10.3f} {p90_ms:10.3f} " \
+               "{p99_ms:10.3f} {per_second:12.1f}".format(**r)
+        if memory:
+            line += " {:12.2f}".format(r.get("memory_kb", np.nan))
+        if per_figure:
+            line += " {:16.2f}".format(1e3 * r["p50_ms"] / max(r["figures"], 1))
+        old = ref.get((r["case"], r["figures"], r["speed"]))
+        if old is not None:
+            line += " {:9.2f}x".format(old["p50_ms"] / r["p50_ms"])
+        print(line)
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks for the simulation and rendering of the game.")
+    parser.add_argument("cases", nargs="*", metavar="case",
+                        help="cases to run, out of: {} (default: all)".format(
+                            ", ".join(CASES)))
+    parser.add_argument("-n", "--figures", type=int, nargs="+", default=[2, 10, 100],
+                        help="numbers of figures (default: 2 10 100)")
+    parser.add_argument("-s", "--speed", type=float, nargs="+",
+                        default=[World.normalspeed],
+                        help="speeds of the figures in pixel per second")
+    parser.add_argument("-t", "--time", type=float, default=0.5,
+                        help="minimal time per case in seconds")
+    parser.add_argument("-i", "--iterations", type=int, default=20,
+                        help="minimal number of iterations per case")
+    parser.add_argument("--memory", action="store_true",
+                        help="also measure the memory allocated temporarily per "
+                             "iteration (with tracemalloc, which is slow)")
+    parser.add_argument("--scaling", action="store_true",
+                        help="run the cases (default: {}) with {} figures and show "
+                             "the time per figure".format(
+                                 " ".join(SCALING_CASES),
+                                 " ".join(str(n) for n in SCALING_FIGURES)))
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="compare with the results in this JSON file")
+    args = parser.parse_args()
+    for name in args.cases:
+        if name not in CASES:
+            parser.error("unknown case: {}".format(name))
+    if args.scaling:
+        args.cases = args.cases or SCALING_CASES
+        args.figures = SCALING_FIGURES
+
+    pygame.display.init()
+    pygame.display.set_mode([main.SCREEN_W, main.SCREEN_H])
+
+    results = []
+    for name in args.cases or CASES:
+        counts = [0] if name in FIXED_CASES else args.figures
+        for n_figures in counts:
+            for speed in args.speed:
+                iteration = CASES[name](n_figures, speed)
+                if iteration is None:
+                    continue
+                durations = measure(iteration, args.time, args.iterations)
+                memory = measure_memory(iteration) if args.memory else None
+                results.append(summarize(name, n_figures, speed, durations, memory))
+
+    reference = None
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)
+    print_results(results, reference, args.scaling)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=1)
+
+
+if __name__ == "__main__":
+    # The images are loaded relative to the directory of the game
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    main_bench()
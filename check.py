@@ -0,0 +1,127 @@
+#! /usr/bin/env python3
+#
+# Checks of the determinism of the simulation.
+#
+# Replays, rollback and matches of bots rely on the simulation giving the
+# same results for the same inputs.  These checks play short matches of bots
+# and verify that
+#
+#   replay    a recorded game is replayed without mismatches and ends with
+#             exactly the same positions,
+#   rollback  simulating the last steps again gives bit-identical states,
+#   scalar    the scalar steps (for few figures) agree with the NumPy steps.
+#
+# They should be run after every change of the physics:
+#
+#     python3 check.py [replay rollback scalar]
+#
+# This module does not depend on pygame.
+
+import argparse
+import os
+import tempfile
+
+import numpy as np
+
+from ai import BotController
+from batch import create_match
+from replay import Recorder, Replay
+from rollback import Rollback
+
+# Duration of a step (in seconds)
+DT = 1/120
+
+# The state of the figures which is compared
+STATE = ("pos", "heading", "speed", "dizzy", "alive")
+
+
+def check_replay(steps=2000, n_figures=40, seed=0):
+    """Record 'steps' steps of a match of bots and replay them.  Return a
+    description of the problem, or None."""
+    world = create_match(n_figures, np.random.default_rng(seed))
+    bots = BotController(world, np.arange(world.n))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "check.rec")
+        recorder = Recorder(world, path, DT)
+        for _ in range(steps):
+            bots.update()
+            recorder.record()
+            world.step(DT)
+        recorder.close()
+        replay = Replay(path)
+        replay.run()
+    if replay.mismatches:
+        return "the replay diverged at tick {}".format(replay.mismatches[0])
+    n = world.n
+    if (replay.world.tick != world.tick
+            or not np.array_equal(replay.world.pos[:n], world.pos[:n])):
+        return "the replay ended at other positions"
+    return None
+
+
+def check_rollback(steps=600, depth=60, n_figures=40, seed=0):
+    """Play 'steps' steps of a match of bots and simulate the last 'depth'
+    of them again.  Return a description of the problem, or None."""
+    world = create_match(n_figures, np.random.default_rng(seed))
+    bots = BotController(world, np.arange(world.n))
+    rollback = Rollback(world, DT, depth + 1)
+    for _ in range(steps):
+        bots.update()
+        rollback.step()
+    n = world.n
+    expected = [getattr(world, name)[:n].copy() for name in STATE]
+    rollback.resimulate(world.tick - depth)
+    for name, array in zip(STATE, expected):
+        if not np.array_equal(getattr(world, name)[:n], array):
+            return "the {} differ after simulating again".format(name)
+    return None
+
+
+def check_scalar(steps=2000, n_figures=8, seed=0, tolerance=1e-6):
+    """Do every step of a match of bots with the scalar and with the NumPy
+    code, from the same state.  Return a description of the problem, or
+    None."""
+    world = create_match(n_figures, np.random.default_rng(seed))
+    bots = BotController(world, np.arange(world.n))
+    other = create_match(n_figures, np.random.default_rng(seed))
+    other.scalar_max = 0
+    n = world.n
+    for _ in range(steps):
+        bots.update()
+        for name in STATE + ("direction", "boosted"):
+            getattr(other, name)[:n] = getattr(world, name)[:n]
+        world.step(DT)
+        other.step(DT)
+        error = np.abs(world.pos[:n] - other.pos[:n]).max()
+        if error > tolerance or not np.array_equal(world.alive[:n], other.alive[:n]):
+            return "the steps differ at tick {} (by {:.2g} pixel)".format(world.tick, error)
+    return None
+
+
+CHECKS = {
+    "replay": check_replay,
+    "rollback": check_rollback,
+    "scalar": check_scalar,
+}
+
+
+def main_check():
+    parser = argparse.ArgumentParser(description="Check the determinism of the simulation.")
+    parser.add_argument("checks", nargs="*", metavar="check",
+                        help="checks to run (default: all of {})".format(", ".join(CHECKS)))
+    args = parser.parse_args()
+
+    for name in args.checks:
+        if name not in CHECKS:
+            parser.error("unknown check: {}".format(name))
+    failed = 0
+    for name in args.checks or CHECKS:
+        problem = CHECKS[name]()
+        print("{:<10} {}".format(name, "ok" if problem is None else "FAILED: " + problem))
+        failed += problem is not None
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main_check()
@@ -7,13 +7,22 @@
 #
 # started by Markus Reinert on 2019-01-13
 
-import time
-from enum import Enum
+import argparse
+import atexit
+import contextlib
+import math
+import warnings
 
 import numpy as np
-import numpy.linalg as LA
 import pygame
 
+import assets
+from ai import BotController
+from arena import arena_world, default_arena, load_arena
+from pipeline import SimulationThread
+from profiler import FrameProfiler
+from world import BT, Clock, FixedTimestep, Wall, default_walls
+
 
 # RGB colour codes
 # (sorry for not being PEP 8 conform here)
@@ -37,6 +46,7 @@ PLAYER_SIZE = 50
 # The first element is the name as displayed.
 # The second element is a "template" for the filenames, such that the full
 # filenames are "<template>.<size>.png", with size 200 and PLAYER_SIZE.
+# The server (net.N_CHARACTERS) has to know their number.
 CHARACTERS = [
     ("Penguin", "images/characters/penguin"),
     ("Wizard Penguin", "images/characters/wizguin"),
@@ -47,246 +57,137 @@ N_CHARACTERS = len(CHARACTERS)
 
 
 class Figure:
+    """A figure of the game, which is a view onto one row of a 'World'."""
+
+    __slots__ = ("world", "index", "name", "pic", "pic_death", "w", "h")
 
-    normalspeed = 500  # pixel per second
-    boostspeed = 1500  # pixel per second
-    acceleration = 600.0  # pixel per second^2
-    boostduration = 0.2  # second
-    dizzyduration = 0.2  # second
+    def __init__(self, name, filename_template, world):
+        self.world = world
+        self.index = world.add_figure()
+        self.set_character(name, filename_template)
+        self.pic_death = assets.load_image("images/other/skull.png")
+        self.w = self.h = PLAYER_SIZE
 
-    def __init__(self, name, filename_template):
-        self.alive = True
+    def set_character(self, name, filename_template):
+        """Show the figure as the character 'name', with the pictures
+        'filename_template' (see CHARACTERS)."""
         self.name = name
-        self.pic = pygame.image.load(
-            ".".join((filename_template, str(PLAYER_SIZE), "png"))
-        )
-        self.pic_death = pygame.image.load("images/other/skull.png")
-        self.w, self.h = self.pic.get_size()
-        self.pos = None
-        self.direction = np.zeros(2)        # direction imposed by user
-        self._direction = np.array([0, 1])  # actual direction (normalized)
-        self.speed = 0
-        # Timer for the last position update
-        self.last_update = None
-        # Timer for the start of dizziness (e.g. after a crash)
-        # When dizzy, direction cannot be changed and booster cannot be
-        # activated but one can decrease velocity.
-        self.dizzy_start = None
+        # When the figure is drawn larger than its normal size, the large
+        # image is scaled down instead of scaling up the small one
+        size = 200 if assets.get_scale() > 1 else PLAYER_SIZE
+        self.pic = assets.load_image(".".join((filename_template, str(size), "png")),
+                                     (PLAYER_SIZE, PLAYER_SIZE))
+
+    @property
+    def alive(self):
+        return bool(self.world.alive[self.index])
+
+    @alive.setter
+    def alive(self, value):
+        self.world.alive[self.index] = value
+
+    @property
+    def pos(self):
+        """Position of the top left corner of the figure"""
+        x, y = self.world.pos[self.index].tolist()
+        return (x - self.w/2, y - self.h/2)
+
+    @property
+    def direction(self):
+        """Direction imposed by user"""
+        return self.world.direction[self.index]
+
+    @direction.setter
+    def direction(self, value):
+        self.world.direction[self.index] = value
+
+    @property
+    def speed(self):
+        return self.world.speed[self.index]
+
+    @speed.setter
+    def speed(self, value):
+        self.world.speed[self.index] = value
 
     def set_centre(self, position):
-        self.pos = position - np.array([self.w/2, self.h/2])
-        self.last_update = time.time()
-
-    def update(self):
-        if not self.alive:
-            return
-        current_time = time.time()
-        # Check if still dizzy
-        if self.dizzy_start is not None:
-            if current_time - self.dizzy_start >= self.dizzyduration:
-                self.dizzy_start = None
-        # Evaluate the direction set by player
-        if np.all(self.direction == 0):
-            # Request to halt
-            speed_aim = 0
-        else:
-            # Request to move with normal speed in the given direction
-            speed_aim = self.normalspeed
-            # Change direction if not dizzy
-            if self.dizzy_start is None:
-                # TODO: change gradually
-                self._direction = self.direction / LA.norm(self.direction)
-        # Accelerate or brake as requested
-        current_speed_change = self.acceleration * (current_time-self.last_update)
-        if self.speed < speed_aim:
-            self.speed = min(self.speed + current_speed_change, speed_aim)
-        elif self.speed > speed_aim:
-            self.speed = max(self.speed - current_speed_change, speed_aim)
-        # Move in the current direction with the current velociy
-        current_place_change = self.speed * (current_time-self.last_update)
-        for dx in range(int(round(current_place_change))):
-            # This is not implemented very well, since the position is updated
-            # for one player at first and then for the other, it should be more
-            # in parallel.
-            self.pos += self._direction
-            # Check for collisions
-            # 'colcont' is a global variable.  This could/should be changed.
-            collision = colcont.check_collision(self)
-            # Case 1: no collision occured
-            if collision == CT.NoCollision:
-                continue
-            # Case 2: a deadly collision occured
-            elif collision == CT.Critical:
-                self.alive = False
-                # Dead bodies should disappear after some time
-                break
-            # Case 3: a collision occured, but not critical
-            else:
-                # Set the figure dizzy
-                self.dizzy_start = current_time
-                # Reset to the previous position
-                self.pos -= self._direction
-                # If collided with a wall, adjust the direction according to an
-                # ideal reflection on a solid boundary
-                if collision == CT.Horizontal:
-                    self._direction[1] = -self._direction[1]
-                elif collision == CT.Vertical:
-                    self._direction[0] = -self._direction[0]
-                # If collided with another player, adjust the direction and
-                # speed of both figures according to an elastic collision
-                elif collision == CT.Player:
-                    opponent = colcont.collision_partner
-                    # TODO: make realistic collisions
-                    # Take into account:
-                    # After a zero-friction collision of a moving ball with a
-                    # stationary one of equal mass, the angle between the
-                    # directions of the two balls is 90 degrees, unless the
-                    # collision is head-on. (for further information see, e.g.:
-                    # https://en.wikipedia.org/wiki/Collision#Billiards)
-                    # Exchange speeds (this is unrealistic)
-                    old_speed = self.speed
-                    self.speed = opponent.speed
-                    opponent.speed = old_speed
-                    # Calculate the collision angle
-                    coll_angle = np.arctan2(*((self.pos - opponent.pos)[::-1]))
-                    self_angle = coll_angle - np.arctan2(*(self._direction[::-1]))
-                    c = np.cos(self_angle)
-                    s = np.sin(self_angle)
-                    turn_matrix = np.array([[c, -s], [s, c]])
-                    # this might be unrealistic
-                    self._direction = np.dot(turn_matrix, self._direction)
-                    # this is unrealistic and no good style, because
-                    # '_direction' should be private.
-                    opponent._direction = -self._direction
-        self.last_update = current_time
+        self.world.pos[self.index] = position
 
     def activate_boost(self):
-        # Booster is activated immediately (without accelerating) if not dizzy
-        if self.dizzy_start is None:
-            self.speed = self.boostspeed
+        self.world.activate_boost(self.index)
 
     def get_rect(self):
         """This method is used to check for collisions with the walls"""
-        return self.pic.get_rect().move(self.pos)
-
-    def draw(self, window):
-        if self.alive:
-            window.blit(self.pic, self.pos)
+        return pygame.Rect(self.pos, (self.w, self.h))
+
+    def get_sprites(self, centre=None, alive=None):
+        """Return the images to draw as list of (surface, position), with the
+        figure at 'centre' and alive or not according to 'alive' if given
+        (e.g. from a snapshot or interpolated between two steps)."""
+        if centre is None:
+            pos = self.pos
+        else:
+            pos = (centre[0] - self.w/2, centre[1] - self.h/2)
+        if alive is None:
+            alive = self.alive
+        if alive:
+            return [(self.pic, pos)]
         else:
             # Dead bodies should disappear after some time
-            window.blit(self.pic_death, self.pos)
+            return [(self.pic_death, pos)]
 
-
-class BT(Enum):
-    """Type of border"""
-    Bottom = 0
-    Top = 1
-    Left = 2
-    Right = 3
+    def draw(self, window):
+        window.blits(self.get_sprites())
 
 
 class Border:
-
-    def __init__(self, border_type: BT, size: int):
-        self.type_ = border_type
-        if border_type == BT.Bottom:
-            self.pattern = "-----XXXX----------XXXX-----"
-            self.pic_normal = pygame.image.load("images/walls/alga_normal.png")
-            self.pic_danger = pygame.image.load("images/walls/alga_danger.png")
-            self.x_rep = SCREEN_W / len(self.pattern)
-            self.y_rep = 0
-            self.x = 0
-            self.y = SCREEN_H - self.pic_normal.get_size()[1]
-            self.rect = pygame.Rect(self.x, SCREEN_H-size, SCREEN_W, size)
+    """A wall of the arena with its pictures."""
+
+    # Pictures of the normal and of the dangerous segments of the walls
+    pictures = {
+        BT.Bottom: ("images/walls/alga_normal.png", "images/walls/alga_danger.png"),
+        BT.Top: ("images/walls/ice_normal.png", "images/walls/ice_danger.png"),
+        BT.Left: ("images/walls/grid_normal.png", "images/walls/grid_danger_left.png"),
+        BT.Right: ("images/walls/grid_normal.png", "images/walls/grid_danger_right.png"),
+    }
+
+    def __init__(self, wall: Wall):
+        self.type_ = wall.type_
+        self.pattern = wall.pattern
+        self.x_rep = wall.x_rep
+        self.y_rep = wall.y_rep
+        self.rect = pygame.Rect(wall.rect)
+        normal, danger = self.pictures[wall.type_]
+        self.pic_normal = assets.load_image(normal)
+        self.pic_danger = assets.load_image(danger)
+        self.x, self.y = self.rect.topleft
+        if wall.type_ == BT.Bottom:
             # The y-coordinate to display the image is different from the
             # bounding box of the wall, because the tips of the algae are
             # not enough to bounce or kill.
-        elif border_type == BT.Top:
-            self.pattern = "--XX--XX--X--XX--XX--"
-            self.pic_normal = pygame.image.load("images/walls/ice_normal.png")
-            self.pic_danger = pygame.image.load("images/walls/ice_danger.png")
-            self.x_rep = SCREEN_W / len(self.pattern)
-            self.y_rep = 0
-            self.x = 0
-            self.y = 0
-            self.rect = pygame.Rect(self.x, self.y, SCREEN_W, size)
-        elif border_type == BT.Left:
-            self.pattern = "---XX--XX---"
-            self.pic_normal = pygame.image.load("images/walls/grid_normal.png")
-            self.pic_danger = pygame.image.load("images/walls/grid_danger_left.png")
-            self.x_rep = 0
-            self.y_rep = SCREEN_H / len(self.pattern)
-            self.x = 0
-            self.y = 0
-            self.rect = pygame.Rect(self.x, self.y, size, SCREEN_H)
-        elif border_type == BT.Right:
-            self.pattern = "---XX--XX---"
-            self.pic_normal = pygame.image.load("images/walls/grid_normal.png")
-            self.pic_danger = pygame.image.load("images/walls/grid_danger_right.png")
-            self.x_rep = 0
-            self.y_rep = SCREEN_H / len(self.pattern)
-            self.x = SCREEN_W - size
-            self.y = 0
-            self.rect = pygame.Rect(self.x, self.y, size, SCREEN_H)
-
-    def check_critical(self, x, y):
-        if self.x_rep != 0:
-            if self.pattern[int(x/self.x_rep)] == "X":
-                return True
-        elif self.y_rep != 0:
-            if self.pattern[int(y/self.y_rep)] == "X":
-                return True
-        return False
+            self.y = self.rect.bottom - assets.image_size(normal)[1]
 
-    def draw(self, window):
+    def get_sprites(self):
+        """Return the images to draw as list of (surface, position)."""
+        sprites = []
         for i in range(len(self.pattern)):
             if self.pattern[i] == "X":
-                window.blit(self.pic_danger, (self.x + i*self.x_rep,
-                                              self.y + i*self.y_rep))
+                sprites.append((self.pic_danger, (self.x + i*self.x_rep,
+                                                  self.y + i*self.y_rep)))
             else:
-                window.blit(self.pic_normal, (self.x + i*self.x_rep,
-                                              self.y + i*self.y_rep))
-
-
-class CT(Enum):
-    """Type of collision"""
-    NoCollision = 0
-    Horizontal = 1
-    Vertical = 2
-    Player = 3
-    Critical = 10
-
-
-class CollisionControl:
-
-    def __init__(self, players, walls):
-        self.players = players
-        self.walls = walls
-        self.collision_partner = None
-
-    def check_collision(self, player: Figure) -> CT:
-        rect = player.get_rect()
-        # Check for collision with boundaries
-        for wall in self.walls:
-            if rect.colliderect(wall.rect):
-                if wall.check_critical(rect[0] + rect[2]/2, rect[1] + rect[3]/2):
-                    return CT.Critical
-                elif wall.type_ == BT.Top or wall.type_ == BT.Bottom:
-                    return CT.Horizontal
-                elif wall.type_ == BT.Left or wall.type_ == BT.Right:
-                    return CT.Vertical
-        # Check for collision with other players
-        for fig in self.players:
-            if fig != player and fig.alive:
-                if LA.norm(player.pos - fig.pos) <= PLAYER_SIZE:
-                    self.collision_partner = fig
-                    return CT.Player
-        return CT.NoCollision
+                sprites.append((self.pic_normal, (self.x + i*self.x_rep,
+                                                  self.y + i*self.y_rep)))
+        return sprites
+
+    def draw(self, window):
+        window.blits(self.get_sprites())
 
 
 class Joystick:
     # This class could directly control a figure
 
+    __slots__ = ("x", "y", "x_disp", "y_disp", "x_pointer", "y_pointer", "point",
+                 "star", "star_w", "star_h", "point_w", "point_h", "r_squared")
+
     def __init__(self):
         # Position of the centre and the top right corner of the star
         self.x = self.y = None
@@ -294,10 +195,10 @@ class Joystick:
         # Position of the pointer, relative to the star's centre
         self.x_pointer = self.y_pointer = 0
         # Display information
-        self.point = pygame.image.load("images/control/joystick_pos.png")
-        self.star = pygame.image.load("images/control/joystick_star.png")
-        self.star_w, self.star_h = self.star.get_size()
-        self.point_w, self.point_h = self.point.get_size()
+        self.point = assets.load_image("images/control/joystick_pos.png")
+        self.star = assets.load_image("images/control/joystick_star.png")
+        self.star_w, self.star_h = assets.image_size("images/control/joystick_star.png")
+        self.point_w, self.point_h = assets.image_size("images/control/joystick_pos.png")
         self.r_squared = (self.star_w/2)**2
 
     def activate(self, position):
@@ -318,228 +219,761 @@ class Joystick:
             self.y_pointer = y_mouse - self.y
         else:
             # Scale the position vector to stay within the star
-            self.x_pointer = (x_mouse - self.x) / np.sqrt(norm_squared/self.r_squared)
-            self.y_pointer = (y_mouse - self.y) / np.sqrt(norm_squared/self.r_squared)
+            scale = math.sqrt(norm_squared/self.r_squared)
+            self.x_pointer = (x_mouse - self.x) / scale
+            self.y_pointer = (y_mouse - self.y) / scale
+
+    def get_sprites(self):
+        """Return the images to draw as list of (surface, position)."""
+        if self.x is None:
+            return []
+        return [(self.star, (self.x_disp, self.y_disp)),
+                (self.point, (self.x + self.x_pointer - self.point_w//2,
+                              self.y + self.y_pointer - self.point_h//2))]
 
     def draw(self, window):
-        if self.x is not None:
-            window.blit(self.star, (self.x_disp, self.y_disp))
-            window.blit(self.point, (self.x + self.x_pointer - self.point_w//2,
-                                     self.y + self.y_pointer - self.point_h//2))
-
-
-class AI:
-
-    def __init__(self, figure: Figure, player_list: list):
-        self.figure = figure
-        self.others = player_list
-        self.victim = player_list[0]
-
-    def update(self):
-        # TODO: use booster
-        if not self.victim.alive:
-            for player in self.others:
-                if player.alive:
-                    self.victim = player
-                    break
-            else:
-                self.figure.direction = np.zeros(2)
-                return
-        self.figure.direction = self.victim.pos - self.figure.pos
+        window.blits(self.get_sprites())
 
 
 class Wave:
+    # The waves are only decoration, so they move with the time of the
+    # frames, not with the steps of the world, and stay in the window when
+    # the camera moves
 
     def __init__(self, path, y_offset, speed=0):
-        self.pic = pygame.image.load(path)
-        self.pic2 = pygame.transform.flip(self.pic, True, False)
+        self.pic = assets.load_image(path)
+        self.pic2 = assets.load_flipped_image(path)
         self.x = 0
         self.y = y_offset
+        # Pixel per second
         self.speed = speed
 
-    def update(self):
-        self.x = (self.x + self.speed) % (2*SCREEN_W)
-
-    def draw(self, window):
-        if self.x < SCREEN_W:
-            window.blit(self.pic, (self.x, self.y))
-        window.blit(self.pic2, (self.x - SCREEN_W, self.y))
-        if self.x > SCREEN_W:
-            window.blit(self.pic, (self.x - 2*SCREEN_W, self.y))
-
-
-pygame.init()
-
-# Fonts
-ft_title = pygame.font.Font("fonts/Puk-Regular.otf", 60)
-ft_info = pygame.font.Font(None, 20)
-
-
-def display_character(window, name, path_template):
+    def update(self, dt):
+        """Move the wave for 'dt' seconds."""
+        self.x = (self.x + self.speed * dt) % (2*SCREEN_W)
+
+    def get_rect(self, view=None):
+        """Return the part of the window covered by the wave."""
+        view = view or NATIVE
+        x, y = view.to_screen((0, self.y), fixed=True)
+        return pygame.Rect(x, y, view.length(view.size[0]), self.pic.get_height())
+
+    def offset(self, view=None):
+        """Return the horizontal offset of the wave in pixels of the window."""
+        return int(self.x * (view or NATIVE).scale)
+
+    def draw(self, window, view=None):
+        # Draw at full pixels, such that the picture only changes when the
+        # integer part of the position in the window changes
+        left, y = (view or NATIVE).to_screen((0, self.y), fixed=True)
+        x = self.offset(view)
+        width = self.pic.get_width()
+        # Only draw into the arena, not beside it if the window is wider
+        clip = window.get_clip()
+        window.set_clip(clip.clip(self.get_rect(view)))
+        if x < width:
+            window.blit(self.pic, (left + x, y))
+        window.blit(self.pic2, (left + x - width, y))
+        if x > width:
+            window.blit(self.pic, (left + x - 2*width, y))
+        window.set_clip(clip)
+
+
+def display_character(window, font, name, path_template, view=None):
     """Screen to select a character."""
     # Could be improved a lot.
-    border_size = 20
+    view = view or NATIVE
+    border_size = view.length(20)
     path = ".".join((path_template, "200", "png"))
-    pic = pygame.image.load(path)
+    pic = assets.load_image(path)
     pic_w, pic_h = pic.get_size()
-    text = ft_title.render(" ".join(("<-", name, "->")), 1, WHITE)
+    text = font.render(" ".join(("<-", name, "->")), 1, WHITE)
     text_w, text_h = text.get_size()
-    pygame.draw.rect(window, GREY, (SCREEN_W/2 - pic_w/2 - border_size,
-                                    SCREEN_H/2 - pic_h/2 - text_h - border_size,
+    centre_x, centre_y = view.to_screen((SCREEN_W/2, SCREEN_H/2))
+    pygame.draw.rect(window, GREY, (centre_x - pic_w/2 - border_size,
+                                    centre_y - pic_h/2 - text_h - border_size,
                                     pic_w + border_size*2, pic_h + border_size*2),
                      border_size)
-    window.blit(pic, (SCREEN_W/2 - pic_w/2, SCREEN_H/2 - pic_h/2 - text_h))
-    window.blit(text, (SCREEN_W/2 - text_w/2, SCREEN_H/2 + pic_h/2 - text_h/2))
+    window.blit(pic, (centre_x - pic_w/2, centre_y - pic_h/2 - text_h))
+    window.blit(text, (centre_x - text_w/2, centre_y + pic_h/2 - text_h/2))
+
+
+def select_character(window, font, view=None):
+    """Let the user select a character and return its index."""
+    selected_character = 0
 
+    window.fill(OCEAN)
+    display_character(window, font, *CHARACTERS[selected_character], view)
+    pygame.display.flip()
 
-def draw_background(window, walls, background_layers):
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                exit()
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    exit()
+                elif event.key == pygame.K_RIGHT:
+                    selected_character = (selected_character+1) % N_CHARACTERS
+                    window.fill(OCEAN)
+                    display_character(window, font, *CHARACTERS[selected_character], view)
+                    pygame.display.flip()
+                elif event.key == pygame.K_LEFT:
+                    selected_character = (selected_character-1) % N_CHARACTERS
+                    window.fill(OCEAN)
+                    display_character(window, font, *CHARACTERS[selected_character], view)
+                    pygame.display.flip()
+                elif event.key == pygame.K_SPACE or event.key == pygame.K_RETURN:
+                    return selected_character
+
+
+def create_walls(wall_width=50):
+    """Create the boundaries of the arena."""
+    return [Border(wall) for wall in default_walls(SCREEN_W, SCREEN_H, wall_width)]
+
+
+def create_background():
+    """Create the layers of waves in the background."""
+    return [
+        Wave("images/background/ocean_layer1.png", 210, 21),
+        Wave("images/background/ocean_layer2.png", 325, 39),
+        Wave("images/background/ocean_layer3.png", 415, 57),
+        Wave("images/background/ocean_layer4.png", 480, 75),
+    ]
+
+
+def draw_background(window, walls, background_layers, view=None):
+    view = view or NATIVE
     window.fill(OCEAN)
     # Draw internal waves
     for layer in background_layers:
-        layer.draw(window)
+        layer.draw(window, view)
     # Draw boundaries
     for wall in walls:
-        wall.draw(window)
+        window.blits([(surface, view.to_screen(pos)) for surface, pos in wall.get_sprites()])
+
+
+class View:
+    """Mapping of a part of the world, of size 'world_size', into a window
+    of size 'window_size': the part is scaled to fit into the window and
+    centred in it.  Sizes and positions in the world are in units of the
+    world, which are pixels of the window in the original size.  'origin'
+    is the top left corner of the visible part."""
+
+    def __init__(self, world_size=(SCREEN_W, SCREEN_H), window_size=(SCREEN_W, SCREEN_H)):
+        self.size = tuple(world_size)
+        self.scale = min(window_size[0] / world_size[0], window_size[1] / world_size[1])
+        self.offset = ((window_size[0] - world_size[0] * self.scale) / 2,
+                       (window_size[1] - world_size[1] * self.scale) / 2)
+        self.origin = (0, 0)
+
+    def to_screen(self, pos, fixed=False):
+        """Return the pixel of the window at the position 'pos' of the world
+        (if 'fixed', relative to the visible part, e.g. for decorations that
+        do not move with it)."""
+        x, y = (0, 0) if fixed else self.origin
+        return (int(self.offset[0] + (pos[0] - x) * self.scale),
+                int(self.offset[1] + (pos[1] - y) * self.scale))
+
+    def to_world(self, pos, fixed=False):
+        """Return the position in the world of the pixel 'pos' of the window
+        (if 'fixed', relative to the visible part)."""
+        x, y = (0, 0) if fixed else self.origin
+        return (x + (pos[0] - self.offset[0]) / self.scale,
+                y + (pos[1] - self.offset[1]) / self.scale)
+
+    def length(self, length):
+        """Return a length of the world in pixels of the window."""
+        return int(round(length * self.scale))
+
+    def visible(self, points, margin=0):
+        """Return whether the 'points' of the world are in the visible part,
+        extended by 'margin'."""
+        lo = np.subtract(self.origin, margin)
+        hi = np.add(self.origin, self.size) + margin
+        return np.all((points >= lo) & (points <= hi), axis=1)
+
+
+class Camera(View):
+    """View of the part of an arena of size 'arena_size' around a figure,
+    which is as large as the window in the original size (or the whole
+    arena, if it is smaller)."""
+
+    def __init__(self, arena_size, window_size=(SCREEN_W, SCREEN_H)):
+        super().__init__((min(arena_size[0], SCREEN_W), min(arena_size[1], SCREEN_H)),
+                         window_size)
+        self.arena_size = tuple(arena_size)
+
+    def follow(self, centre):
+        """Move the visible part such that 'centre' is in its middle, as far
+        as possible within the arena."""
+        x = min(max(centre[0] - self.size[0]/2, 0), self.arena_size[0] - self.size[0])
+        y = min(max(centre[1] - self.size[1]/2, 0), self.arena_size[1] - self.size[1])
+        # Move by whole pixels of the window, such that the walls do not
+        # jitter relative to each other
+        self.origin = (round(x * self.scale) / self.scale, round(y * self.scale) / self.scale)
+
+
+# The world in the window of the original size
+NATIVE = View()
+
+
+class TileGrid:
+    """The tiles of the walls, sorted into a grid of cells of 'cell_size'
+    units of the world, to find the tiles in a part of a large arena without
+    going through all of them."""
+
+    def __init__(self, walls, cell_size=256):
+        self.cell_size = cell_size
+        # Cell -> list of (number, surface, position) of the tiles with
+        # their top left corner in this cell, numbered in drawing order
+        self.cells = {}
+        # Largest size of a tile, by which the searched area is extended
+        self.margin = 0
+        number = 0
+        for wall in walls:
+            for surface, (x, y) in wall.get_sprites():
+                cell = (int(x // cell_size), int(y // cell_size))
+                self.cells.setdefault(cell, []).append((number, surface, (x, y)))
+                number += 1
+                self.margin = max(self.margin, max(surface.get_size()) / assets.get_scale())
+
+    def find(self, lo, hi):
+        """Return the tiles overlapping the area from 'lo' to 'hi' as list of
+        (surface, position), in drawing order."""
+        x0, y0 = (int((c - self.margin) // self.cell_size) for c in lo)
+        x1, y1 = (int(c // self.cell_size) for c in hi)
+        tiles = []
+        for i in range(x0, x1 + 1):
+            for j in range(y0, y1 + 1):
+                tiles += self.cells.get((i, j), ())
+        tiles.sort(key=lambda tile: tile[0])
+        return [(surface, pos) for _, surface, pos in tiles]
+
+
+class Renderer:
+    """Draw the game, updating only the parts of the window that changed.
+
+    The ocean and the walls do not change while the view stays, so they are
+    composited into a cached surface.  In every frame, only the areas of
+    moving sprites and of waves that moved by at least one pixel are
+    restored from the cache and redrawn.  When the view moves, the whole
+    window is redrawn, with only the walls in sight.
+    """
+
+    def __init__(self, window, walls, background_layers, view=None):
+        self.window = window
+        self.background_layers = background_layers
+        self.view = view or NATIVE
+        self.tile_grid = TileGrid(walls)
+        # The ocean with the walls, everything that is not moving
+        self.static = pygame.Surface(window.get_size()).convert()
+        # Number of blits and fills done (for profiling)
+        self.blits = 0
+        self._show_walls()
+        self.invalidate()
+
+    def _show_walls(self):
+        # Find the tiles of the walls in sight, to draw them on top of the
+        # waves; the cached surface is only drawn when it is needed
+        self.origin = self.view.origin
+        lo = np.array(self.origin)
+        tiles = self.tile_grid.find(lo, lo + self.view.size)
+        self.wall_tiles = [(surface, surface.get_rect(topleft=self.view.to_screen(pos)))
+                           for surface, pos in tiles]
+        self.static_valid = False
+
+    def invalidate(self):
+        """Redraw the whole window in the next frame."""
+        self.last_sprites = None
+        self.wave_x = [None] * len(self.background_layers)
+
+    def draw(self, sprites, hud=()):
+        """Draw the background and the sprites, given as list of (surface,
+        position in the world) in drawing order, and on top of them the
+        'hud', given as list of (surface, position in the window).  Return
+        the list of rectangles that changed, for 'pygame.display.update'."""
+        if self.view.origin != self.origin:
+            self._show_walls()
+            self.invalidate()
+        to_screen = self.view.to_screen
+        sprites = ([(surface, surface.get_rect(topleft=to_screen(pos)))
+                    for surface, pos in sprites]
+                   + [(surface, surface.get_rect(topleft=(int(x), int(y))))
+                      for surface, (x, y) in hud])
+        if self.last_sprites is None:
+            dirty = [self.window.get_rect()]
+        else:
+            dirty = self._find_dirty(sprites)
+        for rect in dirty:
+            self._restore(rect)
+        # A sprite touching a restored area has to be redrawn completely;
+        # '_find_dirty' makes sure that its whole area has been restored.
+        redraw = [(surface, rect) for surface, rect in sprites
+                  if rect.collidelist(dirty) != -1]
+        self.window.blits(redraw, doreturn=False)
+        self.blits += len(redraw)
+        self.last_sprites = sprites
+        self.wave_x = [layer.offset(self.view) for layer in self.background_layers]
+        return dirty
+
+    def _find_dirty(self, sprites):
+        dirty = []
+        # Sprites that moved or changed, at their old and new places
+        if len(sprites) != len(self.last_sprites):
+            dirty += [rect for _, rect in self.last_sprites + sprites]
+        else:
+            for (surface, rect), (old_surface, old_rect) in zip(sprites, self.last_sprites):
+                if surface is not old_surface or rect != old_rect:
+                    dirty += [old_rect, rect]
+        # Waves that moved by at least one pixel
+        for layer, x in zip(self.background_layers, self.wave_x):
+            if layer.offset(self.view) != x:
+                dirty.append(layer.get_rect(self.view))
+        dirty = _merge_rects(dirty)
+        # Sprites overlapping a dirty area are redrawn, so their area has to
+        # be restored completely
+        changed = True
+        while changed:
+            changed = False
+            for _, rect in sprites:
+                index = rect.collidelist(dirty)
+                if index != -1 and not dirty[index].contains(rect):
+                    dirty = _merge_rects(dirty + [rect])
+                    changed = True
+        return dirty
+
+    def _restore(self, rect):
+        # Draw the background within 'rect'; the walls have to be drawn on
+        # top of the waves
+        layers = [layer for layer in self.background_layers
+                  if layer.get_rect(self.view).colliderect(rect)]
+        if not layers:
+            if not self.static_valid:
+                self.static.fill(OCEAN)
+                self.static.blits(self.wall_tiles, doreturn=False)
+                self.static_valid = True
+                self.blits += 1 + len(self.wall_tiles)
+            self.window.blit(self.static, rect, rect)
+            self.blits += 1
+        else:
+            self.window.fill(OCEAN, rect)
+            self.window.set_clip(rect)
+            for layer in layers:
+                layer.draw(self.window, self.view)
+            tiles = [tile for tile in self.wall_tiles if tile[1].colliderect(rect)]
+            self.window.blits(tiles, doreturn=False)
+            self.window.set_clip(None)
+            # A wave is drawn with up to two blits
+            self.blits += 1 + 2 * len(layers) + len(tiles)
+
+
+def _merge_rects(rects):
+    """Merge overlapping rectangles, such that no area is drawn twice."""
+    rects = [pygame.Rect(rect) for rect in rects]
+    merged = []
+    while rects:
+        rect = rects.pop()
+        index = rect.collidelist(rects)
+        while index != -1:
+            rect.union_ip(rects.pop(index))
+            index = rect.collidelist(rects)
+        # The enlarged rectangle may overlap rectangles merged before
+        index = rect.collidelist(merged)
+        if index != -1:
+            rects.append(rect.union(merged.pop(index)))
+        else:
+            merged.append(rect)
+    return merged
 
 
-window = pygame.display.set_mode([SCREEN_W, SCREEN_H])
+class PerformanceOverlay:
+    """Graph of the durations of the phases of the last frames, with their
+    percentiles and the mean counts per frame of the profiler."""
 
-# Display the screen to select a character
-selected_character = 0
+    # Colours of the phases (in the order of their first use)
+    colours = [[220, 70, 50], [240, 170, 30], [70, 160, 70], [50, 110, 220],
+               [150, 80, 190], [100, 100, 100]]
+    # Duration of a frame shown by the full height of the graph (in seconds)
+    scale = 1/30
 
-window.fill(OCEAN)
-display_character(window, *CHARACTERS[selected_character])
-pygame.display.flip()
+    def __init__(self, profiler, font, width=240, height=80):
+        self.profiler = profiler
+        self.font = font
+        self.width = width
+        self.height = height
+        self.visible = False
+        self.surface = None
 
-running = True
-while running:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            exit()
+    def update(self):
+        """Draw the overlay anew with the latest measurements."""
+        profiler = self.profiler
+        phases = profiler.phases
+        palette = [self.colours[k % len(self.colours)] for k in range(len(phases))]
+        lines = [("frame: p50 {:.1f}, p99 {:.1f} ms".format(
+            *profiler.percentiles(None, (50, 99))), BLACK)]
+        for name, colour in zip(phases, palette):
+            lines.append(("{}: p50 {:.2f}, p99 {:.2f} ms".format(
+                name, *profiler.percentiles(name, (50, 99))), colour))
+        for name in profiler.counters:
+            lines.append(("{}: {:.0f} per frame".format(name, profiler.mean_count(name)),
+                          BLACK))
+        texts = [self.font.render(line, 1, colour) for line, colour in lines]
+        # One column per frame with the phases stacked from the bottom, and a
+        # line at the duration of a frame at 60 FPS
+        graph = np.full((self.width, self.height, 3), 255, dtype=np.uint8)
+        if phases and profiler.frame > 0:
+            times = np.array([profiler.recent_times(name)[-self.width:] for name in phases])
+            top = np.cumsum(times, axis=0) * self.height / self.scale
+            y = np.arange(self.height)[::-1]
+            phase = np.sum(y[None, None, :] >= top[:, :, None], axis=0)
+            graph[self.width - times.shape[1]:] = np.array(palette + [WHITE])[phase]
+        graph[:, self.height - int(self.height / 60 / self.scale)] = GREY
+        width = max([self.width] + [text.get_width() for text in texts])
+        text_h = sum(text.get_height() for text in texts)
+        self.surface = pygame.Surface((width, self.height + text_h)).convert()
+        self.surface.fill(WHITE)
+        self.surface.blit(pygame.surfarray.make_surface(graph), (0, 0))
+        y = self.height
+        for text in texts:
+            self.surface.blit(text, (0, y))
+            y += text.get_height()
+
+    def get_sprites(self):
+        """Return the images to draw as list of (surface, position)."""
+        if not self.visible or self.surface is None:
+            return []
+        window_w = pygame.display.get_surface().get_width()
+        return [(self.surface, (window_w - self.surface.get_width(), 0))]
+
+
+class UserControl:
+    """Control of a figure with mouse (or touchscreen) and keyboard."""
+
+    def __init__(self, joystick, view=None):
+        # The joystick stays in the window when the camera moves, so its
+        # positions are relative to the visible part of the world
+        self.joystick = joystick
+        self.view = view or NATIVE
+        # For user control (can be integrated into the joystick)
+        self.press_pos = None
+        self.pressed = 0
+
+    def handle(self, event, figure):
+        """Change the direction of 'figure' according to 'event'.  Return
+        True if the booster of the figure shall be activated."""
         if event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_ESCAPE:
-                exit()
-            elif event.key == pygame.K_RIGHT:
-                selected_character = (selected_character+1) % N_CHARACTERS
-                window.fill(OCEAN)
-                display_character(window, *CHARACTERS[selected_character])
-                pygame.display.flip()
-            elif event.key == pygame.K_LEFT:
-                selected_character = (selected_character-1) % N_CHARACTERS
-                window.fill(OCEAN)
-                display_character(window, *CHARACTERS[selected_character])
-                pygame.display.flip()
-            elif event.key == pygame.K_SPACE or event.key == pygame.K_RETURN:
-                running = False
-
-# Create the selected character to be controled by the user
-player1 = Figure(*CHARACTERS[selected_character])
-player1.set_centre(np.array([100, 100]))
-joystick = Joystick()
-
-# Create a bot character
-player2 = Figure(*CHARACTERS[-1])
-player2.set_centre(np.array([SCREEN_W-100, SCREEN_H-100]))
-bot = AI(player2, [player1])
-
-# Create the boundaries
-wall_width = 50
-walls = []
-walls.append(Border(BT.Left, wall_width))
-walls.append(Border(BT.Right, wall_width))
-walls.append(Border(BT.Bottom, wall_width))
-walls.append(Border(BT.Top, wall_width))
-
-# Set up the collision control
-colcont = CollisionControl([player1, player2], walls)
-
-# Create the background
-background_layers = [
-    Wave("images/background/ocean_layer1.png", 210, 0.35),
-    Wave("images/background/ocean_layer2.png", 325, 0.65),
-    Wave("images/background/ocean_layer3.png", 415, 0.95),
-    Wave("images/background/ocean_layer4.png", 480, 1.25),
-]
-
-# For user control (can be integrated into the joystick)
-press_pos = None
-pressed = 0
-# To measure the framerate:
-frame = 0
-frame_time = time.time()
-fps = 0
-fps_text = ft_info.render("FPS: {}".format(fps), 1, BLACK)
-# Start main game loop
-while True:
-    # Compute framerate
-    # TODO use the tools described in the Pygame docs:
-    # https://www.pygame.org/docs/ref/time.html#pygame.time.Clock
-    frame += 1
-    if frame == 10:
-        frame = 0
-        current_time = time.time()
-        fps = int(10 // (current_time-frame_time))
-        fps_text = ft_info.render("FPS: {}".format(fps), 1, BLACK)
-        frame_time = current_time
-    # Update routine
-    player1.update()
-    player2.update()
-    for layer in background_layers:
-        layer.update()
-    draw_background(window, walls, background_layers)
-    window.blit(fps_text, (0, 0))
-    joystick.draw(window)
-    player1.draw(window)
-    player2.draw(window)
-    pygame.display.flip()
-    # Handle events
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            exit()
-        elif event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_ESCAPE:
-                exit()
-            # For debugging only (restart should be implemented with a menu)
-            elif event.key == pygame.K_r:
-                player1.alive = True
-                player1.set_centre(np.array([500.0, 200.0]))
             # For debugging only (well, there could be a keyboard control, but
             # then the buttons have to be kept pressed to move in a direction;
             # furthermore, one needs to be able to move diagonally)
-            elif event.key == pygame.K_LEFT:
-                player1.direction = np.array([-1, 0])
+            if event.key == pygame.K_LEFT:
+                figure.direction = (-1, 0)
             elif event.key == pygame.K_RIGHT:
-                player1.direction = np.array([+1, 0])
+                figure.direction = (+1, 0)
             elif event.key == pygame.K_UP:
-                player1.direction = np.array([0, -1])
+                figure.direction = (0, -1)
             elif event.key == pygame.K_DOWN:
-                player1.direction = np.array([0, +1])
+                figure.direction = (0, +1)
             elif event.key == pygame.K_SPACE:
-                player1.activate_boost()
+                return True
         # Other possbility to implement mouse control:
         # mouse motion is directly translated to an according motion of the
         # figure and a mouse click activates boost.  This might be better for
         # control with the touchpad of a laptop.
         # The way it is implemented now is intended for touchscreens.
         elif event.type == pygame.MOUSEBUTTONDOWN:
-            pressed += 1
-            if press_pos is None:
-                press_pos = np.array(event.pos)
-                joystick.activate(press_pos)
+            self.pressed += 1
+            if self.press_pos is None:
+                self.press_pos = self.view.to_world(event.pos, fixed=True)
+                self.joystick.activate(self.press_pos)
             else:
-                player1.direction = np.array(event.pos) - press_pos
-                player1.activate_boost()
+                x, y = self.view.to_world(event.pos, fixed=True)
+                figure.direction = (x - self.press_pos[0], y - self.press_pos[1])
+                return True
         elif event.type == pygame.MOUSEBUTTONUP:
-            pressed -= 1
-            if pressed == 0:
-                press_pos = None
-                player1.direction = np.zeros(2)
-                player1.speeed = 0
-                joystick.deactivate()
+            self.pressed -= 1
+            if self.pressed == 0:
+                self.press_pos = None
+                # The world brakes the figure without a direction
+                figure.direction = (0, 0)
+                self.joystick.deactivate()
         elif event.type == pygame.MOUSEMOTION:
-            if press_pos is not None:
-                player1.direction = np.array(event.pos) - press_pos
-                joystick.set_direction(event.pos)
-    # Let the AI make its move
-    bot.update()
+            if self.press_pos is not None:
+                x, y = self.view.to_world(event.pos, fixed=True)
+                figure.direction = (x - self.press_pos[0], y - self.press_pos[1])
+                self.joystick.set_direction((x, y))
+        return False
+
 
+def main(argv=None):
+    """Play the game with the command line arguments 'argv' (by default
+    those of the program)."""
+    parser = argparse.ArgumentParser(description="Play the game.")
+    parser.add_argument("--connect", metavar="HOST[:PORT]",
+                        help="play online on the server at this address "
+                             "(see 'net.py serve')")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record the game into this file (see 'replay.py')")
+    parser.add_argument("--fps", type=float, default=60,
+                        help="maximal frame rate (default: 60, 0 for no limit)")
+    parser.add_argument("--vsync", action="store_true",
+                        help="synchronize the frames with the display, where "
+                             "available (else, the frame rate is limited by --fps)")
+    parser.add_argument("--tick-rate", type=float, default=120,
+                        help="steps of the simulation per second (default: 120)")
+    parser.add_argument("--no-thread", action="store_true",
+                        help="run the simulation in the main loop instead of "
+                             "a thread of its own")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write the durations of the phases of the frames "
+                             "into this file, in the Chrome trace format")
+    parser.add_argument("--size", metavar="WxH",
+                        help="size of the window (default: {}x{}), the arena is "
+                             "scaled to fit".format(SCREEN_W, SCREEN_H))
+    parser.add_argument("--fullscreen", action="store_true",
+                        help="fill the screen, in its resolution")
+    parser.add_argument("--arena", metavar="FILE",
+                        help="play in the arena described or compiled in this "
+                             "file (see 'arena.py')")
+    args = parser.parse_args(argv)
+    if args.connect and args.arena:
+        parser.error("the arena of an online game is chosen by the server")
+    if args.connect:
+        host, _, port = args.connect.partition(":")
+        if port and not (port.isdigit() and 0 < int(port) < 65536):
+            parser.error("the server has to be given as HOST[:PORT], e.g. localhost:4713")
+    try:
+        arena = load_arena(args.arena) if args.arena else default_arena(SCREEN_W, SCREEN_H)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    window_size = [SCREEN_W, SCREEN_H]
+    if args.size:
+        try:
+            window_size = [int(length) for length in args.size.lower().split("x")]
+        except ValueError:
+            window_size = []
+        if len(window_size) != 2 or min(window_size) <= 0:
+            parser.error("the size has to be given as WIDTHxHEIGHT, e.g. 1920x1080")
+    if args.connect and args.record:
+        parser.error("only games played offline can be recorded")
+
+    # Only the parts of pygame in use are started: the display here, the
+    # fonts when the first one is loaded (see 'assets').  The game has no
+    # sound, so the mixer, which may take long to open the audio device, is
+    # never started.
+    pygame.display.init()
+
+    flags = 0
+    if args.fullscreen:
+        flags |= pygame.FULLSCREEN
+        window_size = [0, 0]
+    window = None
+    if args.vsync:
+        # Vsync is only available with a renderer of SDL, i.e. a scaled or
+        # OpenGL window, and not on every system
+        try:
+            window = pygame.display.set_mode(window_size, flags | pygame.SCALED, vsync=1)
+        except pygame.error:
+            warnings.warn("Vsync is not available, the frame rate is limited instead")
+    if window is None:
+        window = pygame.display.set_mode(window_size, flags)
+    # The game is simulated in units of the world (the pixels of the window
+    # in its original size), only the drawing is scaled to the window
+    # The camera shows the part of the arena around the player
+    view = Camera((arena.width, arena.height), window.get_size())
+    assets.set_scale(view.scale)
+
+    # Fonts
+    ft_title = assets.load_font("fonts/Puk-Regular.otf", view.length(60))
+    ft_info = assets.load_font(None, view.length(20))
+
+    # Display the screen to select a character
+    selected_character = select_character(window, ft_title, view)
+
+    walls = [Border(wall) for wall in arena.walls]
+
+    # Set up the world, which moves all figures and controls their collisions
+    world = arena_world(arena, PLAYER_SIZE)
+
+    if args.connect:
+        # The world is simulated by the server; the figures are created when
+        # they appear in its snapshots (the network code is only imported
+        # when it is used, since it takes a while)
+        from net import DEFAULT_PORT, NetClient, unpack_world
+        try:
+            client = NetClient(host, int(port or DEFAULT_PORT), selected_character)
+        except OSError as error:
+            raise SystemExit("Cannot connect to {}: {}".format(args.connect, error))
+        figures = []
+        player1 = None
+        sent_direction = None
+    else:
+        client = None
+        # Create the selected character to be controled by the user
+        # The figures start at the places given by the arena, or else at
+        # random free places
+        rng = np.random.default_rng()
+        lo = np.array([PLAYER_SIZE, PLAYER_SIZE])
+        hi = np.array([arena.width, arena.height]) - PLAYER_SIZE
+        player1 = Figure(*CHARACTERS[selected_character], world)
+        player1.set_centre(np.array(arena.spawns[0]) if len(arena.spawns) > 0
+                           else world.free_place(rng, lo, hi))
+        # Create a bot character
+        player2 = Figure(*CHARACTERS[-1], world)
+        player2.set_centre(np.array(arena.spawns[1]) if len(arena.spawns) > 1
+                           else world.free_place(rng, lo, hi))
+        # The bots may think for a quarter of a step, such that they never
+        # delay the simulation
+        bots = BotController(world, [player2.index], victims=[player1.index],
+                             budget=0.25 / args.tick_rate)
+        figures = [player1, player2]
+    joystick = Joystick()
+    control = UserControl(joystick, view)
+
+    background_layers = create_background()
+    renderer = Renderer(window, walls, background_layers, view)
+
+    # The world moves with a fixed time step, independent of the frame rate
+    simulation = FixedTimestep(world, dt=1/args.tick_rate, clock=Clock())
+    # The AI makes its move before every step of the world, and the moves of
+    # all figures are recorded if requested
+    recorder = None
+    before_step = None
+    if client is None and args.record:
+        from replay import Recorder
+        recorder = Recorder(world, args.record, simulation.dt,
+                            [selected_character, N_CHARACTERS - 1])
+        atexit.register(recorder.close)
+
+        def update_and_record():
+            bots.update()
+            recorder.record()
+        before_step = update_and_record
+    elif client is None:
+        before_step = bots.update
+    # Offline, the world is simulated in a thread of its own, which
+    # publishes snapshots for drawing; changes of the world from the main
+    # loop have to hold its lock
+    sim_thread = None
+    world_lock = contextlib.nullcontext()
+    if client is None and not args.no_thread:
+        sim_thread = SimulationThread(simulation, before_step)
+        world_lock = sim_thread.lock
+        sim_thread.start()
+        atexit.register(sim_thread.stop)
+    # Measure the phases of every frame; F3 shows the measurements
+    profiler = FrameProfiler(trace=args.trace is not None)
+    if args.trace:
+        atexit.register(profiler.dump_trace, args.trace)
+    profiler.watch("collision checks", lambda: world.colcont.checks)
+    profiler.watch("blits", lambda: renderer.blits)
+    if client is None:
+        profiler.watch("bot plans", lambda: bots.total_plans)
+    overlay = PerformanceOverlay(profiler, ft_info)
+    fps_text = ft_info.render("FPS: 0", 1, BLACK)
+    # The frames are paced by a clock, such that the game does not use a
+    # whole core for drawing more frames than the display can show
+    clock = pygame.time.Clock()
+    frame_time = 0.0
+    # Start main game loop
+    while True:
+        profiler.begin_frame()
+        # Show the framerate (and the measurements) a few times per second
+        if profiler.frame % 10 == 0:
+            fps_text = ft_info.render("FPS: {:.1f}".format(profiler.fps()), 1, BLACK)
+            if overlay.visible:
+                overlay.update()
+        # Update routine
+        if sim_thread is not None:
+            with profiler.phase("snapshot"):
+                # Draw the figures between the last two steps
+                snapshot = sim_thread.buffer.latest()
+                centres = snapshot.interpolated_pos(sim_thread.alpha(snapshot))
+                alive = snapshot.alive
+        elif client is None:
+            with profiler.phase("simulation"):
+                simulation.advance(before_step)
+                centres = simulation.interpolated_pos()
+                alive = world.alive
+        else:
+            with profiler.phase("network"):
+                try:
+                    client.poll()
+                except ConnectionError as error:
+                    raise SystemExit("Connection to {} lost: {}".format(args.connect, error))
+                for character in client.state["character"][len(figures):]:
+                    figures.append(Figure(*CHARACTERS[character], world))
+                # The figures of players who left are taken over by new
+                # players, maybe with other characters
+                for figure, character in zip(figures, client.state["character"]):
+                    if figure.name != CHARACTERS[character][0]:
+                        figure.set_character(*CHARACTERS[character])
+                unpack_world(client.state, world)
+                if (player1 is None and client.index is not None
+                        and client.index < len(figures)):
+                    player1 = figures[client.index]
+                centres = world.pos
+                alive = world.alive
+        with profiler.phase("waves"):
+            for layer in background_layers:
+                layer.update(frame_time)
+        with profiler.phase("draw"):
+            # The figures are drawn from lists of Python numbers, which is
+            # faster than picking single numbers out of NumPy arrays
+            centre_list = centres.tolist()
+            alive_list = alive.tolist()
+            if player1 is not None:
+                view.follow(centre_list[player1.index])
+            # Only the figures in sight are drawn
+            visible = view.visible(centres, PLAYER_SIZE).tolist()
+            sprites = []
+            for figure in figures:
+                if visible[figure.index]:
+                    sprites += figure.get_sprites(centre_list[figure.index],
+                                                  alive_list[figure.index])
+            # The joystick and the texts are drawn in the window, outside of
+            # the world
+            hud = ([(surface, view.to_screen(pos, fixed=True))
+                    for surface, pos in joystick.get_sprites()]
+                   + [(fps_text, (0, 0))] + overlay.get_sprites())
+            dirty = renderer.draw(sprites, hud)
+        with profiler.phase("display"):
+            pygame.display.update(dirty)
+        with profiler.phase("events"), world_lock:
+            boost = False
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    exit()
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                    exit()
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    overlay.visible = not overlay.visible
+                    overlay.update()
+                # For debugging only (restart should be implemented with a menu)
+                elif (event.type == pygame.KEYDOWN and event.key == pygame.K_r
+                      and client is None):
+                    player1.alive = True
+                    player1.set_centre(np.array([500.0, 200.0]))
+                    if recorder is not None:
+                        recorder.keyframe()
+                elif player1 is not None:
+                    boost |= control.handle(event, player1)
+            if client is None:
+                if boost:
+                    player1.activate_boost()
+            elif player1 is not None:
+                # Only send the input to the server when it changed
+                direction = tuple(player1.direction)
+                if boost or direction != sent_direction:
+                    try:
+                        client.send_input(direction, boost)
+                    except ConnectionError as error:
+                        raise SystemExit("Connection to {} lost: {}".format(args.connect, error))
+                    sent_direction = direction
+        with profiler.phase("wait"):
+            frame_time = clock.tick(args.fps) / 1000
+        profiler.end_frame()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,427 @@
+#! /usr/bin/env python3
+#
+# Network play: an authoritative game server and the client side of it.
+#
+# The server runs the simulation of the game without a window at a fixed
+# tick rate.  Clients connect via TCP, send their input (direction and
+# booster) and regularly receive snapshots of the state of all figures.  The
+# snapshots are packed with NumPy into a compact binary format, and only the
+# figures that changed since the last snapshot sent to a client are
+# transmitted (TCP delivers every snapshot, so the client always knows the
+# previous one).
+#
+# Usage:
+#     python3 net.py serve [--port PORT] [--bots N]
+#     python3 main.py --connect HOST[:PORT]
+#     python3 net.py loadtest [-n 2 8 32]
+#
+# The load test runs a server and a number of simulated clients on localhost
+# and reports the bandwidth per client and the time per server tick.
+
+import argparse
+import asyncio
+import json
+import math
+import socket
+import struct
+import time
+from collections import deque
+
+import numpy as np
+
+from ai import BotController
+from arena import ARENA_H, ARENA_W, create_world
+
+DEFAULT_PORT = 4713
+
+# Number of characters (main.CHARACTERS) and character of the bots
+N_CHARACTERS = 3
+BOT_CHARACTER = 2
+
+# Types of messages
+JOIN = 1      # client -> server: character
+INPUT = 2     # client -> server: direction and booster
+WELCOME = 3   # server -> client: index of the client's figure, tick rate
+SNAPSHOT = 4  # server -> client: state of all figures, see 'encode_snapshot'
+
+# Every message starts with the length of its content and its type
+HEADER = struct.Struct("<HB")
+JOIN_CONTENT = struct.Struct("<B")
+INPUT_CONTENT = struct.Struct("<ffB")
+WELCOME_CONTENT = struct.Struct("<HH")
+SNAPSHOT_HEADER = struct.Struct("<IH")
+
+# State of one figure in a snapshot
+FIGURE_STATE = np.dtype([
+    ("x", "<i2"),          # centre, in 1/POSITION_SCALE pixel
+    ("y", "<i2"),
+    ("hx", "i1"),          # direction of motion, times 127
+    ("hy", "i1"),
+    ("speed", "<u2"),      # pixel per second
+    ("flags", "u1"),       # ALIVE and DIZZY
+    ("character", "u1"),
+])
+POSITION_SCALE = 4
+ALIVE = 1
+DIZZY = 2
+
+
+def message(type_, content=b""):
+    return HEADER.pack(len(content), type_) + content
+
+
+def pack_world(world, characters):
+    """Return the state of all figures of 'world' as array of FIGURE_STATE.
+    'characters' are the characters of the figures."""
+    n = world.n
+    state = np.zeros(n, dtype=FIGURE_STATE)
+    pos = np.round(world.pos[:n] * POSITION_SCALE).clip(-2**15, 2**15 - 1)
+    state["x"] = pos[:, 0]
+    state["y"] = pos[:, 1]
+    heading = np.round(world.heading[:n] * 127)
+    state["hx"] = heading[:, 0]
+    state["hy"] = heading[:, 1]
+    state["speed"] = np.round(world.speed[:n]).clip(0, 2**16 - 1)
+    state["flags"] = np.where(world.alive[:n], ALIVE, 0) | np.where(world.dizzy[:n] > 0, DIZZY, 0)
+    state["character"] = characters[:n]
+    return state
+
+
+def unpack_world(state, world):
+    """Write the state of the figures into 'world', which must have at least
+    as many figures."""
+    n = len(state)
+    world.pos[:n, 0] = state["x"] / POSITION_SCALE
+    world.pos[:n, 1] = state["y"] / POSITION_SCALE
+    world.heading[:n, 0] = state["hx"] / 127
+    world.heading[:n, 1] = state["hy"] / 127
+    world.speed[:n] = state["speed"]
+    world.alive[:n] = state["flags"] & ALIVE != 0
+    world.dizzy[:n] = np.where(state["flags"] & DIZZY, world.dizzyduration, 0)
+
+
+def encode_snapshot(tick, state, base):
+    """Encode 'state' as difference to 'base', the state the receiver knows.
+
+    The snapshot consists of the tick and the number of figures, a bit mask
+    of the figures that changed, and the states of these figures.
+    """
+    n = len(state)
+    changed = np.ones(n, dtype=bool)
+    m = min(n, len(base))
+    changed[:m] = state[:m] != base[:m]
+    mask = np.packbits(changed, bitorder="little")
+    return SNAPSHOT_HEADER.pack(tick, n) + mask.tobytes() + state[changed].tobytes()
+
+
+def decode_snapshot(content, base):
+    """Decode a snapshot relative to 'base'.  Return the tick and the state."""
+    tick, n = SNAPSHOT_HEADER.unpack_from(content)
+    offset = SNAPSHOT_HEADER.size
+    n_mask = (n + 7) // 8
+    mask = np.frombuffer(content, dtype=np.uint8, count=n_mask, offset=offset)
+    changed = np.unpackbits(mask, count=n, bitorder="little").astype(bool)
+    state = np.zeros(n, dtype=FIGURE_STATE)
+    m = min(n, len(base))
+    state[:m] = base[:m]
+    state[changed] = np.frombuffer(content, dtype=FIGURE_STATE, offset=offset + n_mask)
+    return tick, state
+
+
+async def read_message(reader):
+    length, type_ = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return type_, await reader.readexactly(length)
+
+
+class _Connection:
+    # A client as seen by the server
+
+    def __init__(self, index, writer):
+        self.index = index
+        self.writer = writer
+        self.boost = False
+        # State of the figures the client knows
+        self.base = np.zeros(0, dtype=FIGURE_STATE)
+        self.bytes_sent = 0
+
+
+class GameServer:
+    """Run 'world' authoritatively for clients connecting via TCP.
+
+    Every client controls one figure.  The world is advanced with 'tick_rate'
+    steps per second and a snapshot is sent to all clients every
+    'snapshot_every' steps.  'n_bots' bots are added to the world.
+    """
+
+    # Number of bytes waiting to be sent to a client, from which on no more
+    # snapshots are sent to it until it caught up
+    max_backlog = 64 * 1024
+    # Number of ticks whose durations are kept
+    max_tick_times = 100000
+
+    def __init__(self, world, tick_rate=60, snapshot_every=2, n_bots=0, seed=None):
+        self.world = world
+        self.tick_rate = tick_rate
+        self.snapshot_every = snapshot_every
+        self.rng = np.random.default_rng(seed)
+        self.characters = np.zeros(0, dtype=np.uint8)
+        self.connections = set()
+        # Indices of the figures of players who left, which are given to
+        # the next players who join
+        self.free = []
+        bots = [self.add_figure(BOT_CHARACTER) for _ in range(n_bots)]
+        # The bots may think for a quarter of a tick
+        self.bots = BotController(world, bots, budget=0.25 / tick_rate) if bots else None
+        # Durations of the last ticks (in seconds), for statistics
+        self.tick_times = deque(maxlen=self.max_tick_times)
+        self.running = False
+        self.port = None
+
+    def add_figure(self, character):
+        """Add a figure at a free place and return its index."""
+        world = self.world
+        margin = world.size
+        pos = world.free_place(self.rng, (margin, margin), (ARENA_W - margin, ARENA_H - margin))
+        if self.free:
+            index = world.add_figure(self.free.pop())
+            self.characters[index] = character
+        else:
+            index = world.add_figure()
+            self.characters = np.append(self.characters, np.uint8(character))
+        world.pos[index] = pos
+        return index
+
+    async def _handle_client(self, reader, writer):
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            type_, content = await read_message(reader)
+            if type_ != JOIN:
+                return
+            character, = JOIN_CONTENT.unpack(content)
+            # Clients only know the characters of the game
+            if character >= N_CHARACTERS:
+                return
+            connection = _Connection(self.add_figure(character), writer)
+            writer.write(message(WELCOME, WELCOME_CONTENT.pack(connection.index, self.tick_rate)))
+            self.connections.add(connection)
+            while True:
+                type_, content = await read_message(reader)
+                if type_ == INPUT:
+                    dx, dy, boost = INPUT_CONTENT.unpack(content)
+                    # Invalid directions would break the simulation
+                    if math.isfinite(dx) and math.isfinite(dy):
+                        self.world.direction[connection.index] = (dx, dy)
+                    connection.boost |= bool(boost)
+        except (asyncio.IncompleteReadError, ConnectionError, struct.error):
+            pass
+        finally:
+            for connection in list(self.connections):
+                if connection.writer is writer:
+                    self.connections.discard(connection)
+                    # Figures of players who left are out of the game, and
+                    # their rows are used for the next players
+                    self.world.alive[connection.index] = False
+                    self.free.append(connection.index)
+            writer.close()
+
+    def tick(self):
+        """Advance the world by one step and send the snapshots."""
+        world = self.world
+        for connection in self.connections:
+            if connection.boost:
+                world.activate_boost(connection.index)
+                connection.boost = False
+        if self.bots is not None:
+            self.bots.update()
+        world.step(1 / self.tick_rate)
+        if world.tick % self.snapshot_every == 0:
+            self.broadcast()
+
+    def broadcast(self):
+        state = pack_world(self.world, self.characters)
+        for connection in self.connections:
+            if connection.writer.transport.get_write_buffer_size() > self.max_backlog:
+                continue
+            data = message(SNAPSHOT, encode_snapshot(self.world.tick, state, connection.base))
+            connection.writer.write(data)
+            connection.base = state
+            connection.bytes_sent += len(data)
+
+    async def serve(self, host="", port=DEFAULT_PORT, started=None):
+        """Run the server until 'stop' is called.  'started' is an optional
+        asyncio.Event which is set as soon as clients can connect."""
+        server = await asyncio.start_server(self._handle_client, host, port)
+        self.port = server.sockets[0].getsockname()[1]
+        self.running = True
+        if started is not None:
+            started.set()
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        async with server:
+            while self.running:
+                start = time.perf_counter()
+                self.tick()
+                self.tick_times.append(time.perf_counter() - start)
+                next_tick += 1 / self.tick_rate
+                # If the server cannot keep up, do not try to catch up
+                next_tick = max(next_tick, loop.time())
+                await asyncio.sleep(next_tick - loop.time())
+        for connection in self.connections:
+            connection.writer.close()
+
+    def stop(self):
+        self.running = False
+
+
+class NetClient:
+    """Connection of the game to a server.
+
+    The socket is not blocking, such that 'poll' can be called in every
+    frame of the game to receive the latest state of the figures.
+    """
+
+    def __init__(self, host, port, character):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setblocking(False)
+        self.buffer = bytearray()
+        # Index of the own figure, tick of the last snapshot and state
+        self.index = None
+        self.tick = None
+        self.state = np.zeros(0, dtype=FIGURE_STATE)
+        self.tick_rate = None
+        self._send(message(JOIN, JOIN_CONTENT.pack(character)))
+
+    def _send(self, data):
+        self.sock.setblocking(True)
+        try:
+            self.sock.sendall(data)
+        finally:
+            self.sock.setblocking(False)
+
+    def send_input(self, direction, boost=False):
+        dx, dy = direction
+        self._send(message(INPUT, INPUT_CONTENT.pack(dx, dy, boost)))
+
+    def poll(self):
+        """Receive and process all messages that arrived."""
+        while True:
+            try:
+                data = self.sock.recv(1 << 16)
+            except BlockingIOError:
+                break
+            if not data:
+                raise ConnectionError("Connection closed by the server")
+            self.buffer += data
+        while len(self.buffer) >= HEADER.size:
+            length, type_ = HEADER.unpack_from(self.buffer)
+            end = HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            content = bytes(self.buffer[HEADER.size:end])
+            del self.buffer[:end]
+            if type_ == WELCOME:
+                self.index, self.tick_rate = WELCOME_CONTENT.unpack(content)
+            elif type_ == SNAPSHOT:
+                self.tick, self.state = decode_snapshot(content, self.state)
+
+    def close(self):
+        self.sock.close()
+
+
+async def _robot_client(host, port, duration, seed):
+    # A client sending random input and counting the received bytes
+    rng = np.random.default_rng(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(message(JOIN, JOIN_CONTENT.pack(0)))
+    received = 0
+    snapshots = 0
+    state = np.zeros(0, dtype=FIGURE_STATE)
+
+    async def receive():
+        nonlocal received, snapshots, state
+        while True:
+            type_, content = await read_message(reader)
+            received += HEADER.size + len(content)
+            if type_ == SNAPSHOT:
+                _, state = decode_snapshot(content, state)
+                snapshots += 1
+
+    receiver = asyncio.ensure_future(receive())
+    loop = asyncio.get_running_loop()
+    end = loop.time() + duration
+    while loop.time() < end:
+        dx, dy = rng.normal(size=2)
+        writer.write(message(INPUT, INPUT_CONTENT.pack(dx, dy, rng.random() < 0.1)))
+        await asyncio.sleep(0.1)
+    receiver.cancel()
+    writer.close()
+    return received, snapshots
+
+
+async def load_test(n_clients, duration=5.0, tick_rate=60, n_bots=0):
+    """Run a server and 'n_clients' simulated clients on localhost for
+    'duration' seconds and return statistics as dictionary."""
+    server = GameServer(create_world(), tick_rate=tick_rate, n_bots=n_bots, seed=0)
+    started = asyncio.Event()
+    serving = asyncio.ensure_future(server.serve("127.0.0.1", 0, started))
+    await started.wait()
+    results = await asyncio.gather(*(
+        _robot_client("127.0.0.1", server.port, duration, seed)
+        for seed in range(n_clients)
+    ))
+    server.stop()
+    await serving
+    tick_times = np.array(server.tick_times)
+    received = np.array([r[0] for r in results])
+    return {
+        "clients": n_clients,
+        "bots": n_bots,
+        "tick_rate": tick_rate,
+        "ticks": len(tick_times),
+        "tick_p50_ms": 1e3 * np.percentile(tick_times, 50),
+        "tick_p99_ms": 1e3 * np.percentile(tick_times, 99),
+        "tick_max_ms": 1e3 * tick_times.max(),
+        "bytes_per_second_per_client": received.mean() / duration,
+        "snapshots_per_client": float(np.mean([r[1] for r in results])),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server for network games.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run a game server")
+    serve.add_argument("--host", default="", help="address to listen on")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve.add_argument("--bots", type=int, default=0, help="number of bots")
+    serve.add_argument("--tick-rate", type=int, default=60)
+    loadtest = commands.add_parser("loadtest", help="measure the server on localhost")
+    loadtest.add_argument("-n", "--clients", type=int, nargs="+", default=[2, 8, 32])
+    loadtest.add_argument("-t", "--time", type=float, default=5.0,
+                          help="duration per test in seconds")
+    loadtest.add_argument("--bots", type=int, default=0, help="number of bots")
+    loadtest.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        server = GameServer(create_world(), tick_rate=args.tick_rate, n_bots=args.bots)
+        try:
+            asyncio.run(server.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    else:
+        results = []
+        print("{:>8} {:>8} {:>14} {:>14} {:>16}".format(
+            "clients", "ticks", "tick p50 [ms]", "tick p99 [ms]", "kB/s per client"))
+        for n in args.clients:
+            r = asyncio.run(load_test(n, args.time, n_bots=args.bots))
+            results.append(r)
+            print("{clients:8d} {ticks:8d} {tick_p50_ms:14.3f} {tick_p99_ms:14.3f}".format(**r)
+                  + " {:16.2f}".format(r["bytes_per_second_per_client"] / 1e3))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
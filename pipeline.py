@@ -0,0 +1,148 @@
+# The simulation in a thread of its own.
+#
+# The simulation thread advances the world with a fixed time step and, after
+# every step, publishes a snapshot of the state of the figures.  The render
+# loop draws the latest snapshot, so slow drawing or a slow update of the
+# display does not delay the simulation, and expensive steps do not block
+# the drawing.  While one waits for the display (or for the next frame),
+# the other can run, since pygame and the sleeping functions release the
+# GIL.
+#
+# Snapshots are kept in a ring of preallocated slots: the writer always
+# writes into a slot that is neither the newest one nor the one being read,
+# so a snapshot does not change while it is drawn.  Everything else that
+# changes the world (the input of the user) has to hold the lock of the
+# simulation thread, so it happens between two steps.
+#
+# This module does not depend on pygame.
+
+import threading
+
+import numpy as np
+
+
+class Snapshot:
+    """State of the figures of a world after a step, read-only for readers.
+
+    'pos' are the positions after the step, 'previous_pos' those before it.
+    'due' is the time of the clock of the simulation from which on the
+    state is current, such that positions in between can be interpolated.
+    """
+
+    def __init__(self, capacity):
+        self._allocate(capacity)
+        self.n = 0
+        self.tick = 0
+        self.time = 0.0
+        self.due = 0.0
+
+    def _allocate(self, capacity):
+        self._pos = np.zeros((capacity, 2))
+        self._previous_pos = np.zeros((capacity, 2))
+        self._heading = np.zeros((capacity, 2))
+        self._speed = np.zeros(capacity)
+        self._dizzy = np.zeros(capacity)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._views(0)
+
+    def _views(self, n):
+        # Read-only views of the used rows
+        for name in ("pos", "previous_pos", "heading", "speed", "dizzy", "alive"):
+            view = getattr(self, "_" + name)[:n]
+            view.flags.writeable = False
+            setattr(self, name, view)
+
+    def write(self, world, previous_pos, due):
+        n = world.n
+        if n > len(self._speed):
+            self._allocate(2 * n)
+        self._pos[:n] = world.pos[:n]
+        if previous_pos is not None and len(previous_pos) == n:
+            self._previous_pos[:n] = previous_pos
+        else:
+            self._previous_pos[:n] = world.pos[:n]
+        self._heading[:n] = world.heading[:n]
+        self._speed[:n] = world.speed[:n]
+        self._dizzy[:n] = world.dizzy[:n]
+        self._alive[:n] = world.alive[:n]
+        self._views(n)
+        self.n = n
+        self.tick = world.tick
+        self.time = world.time
+        self.due = due
+
+    def interpolated_pos(self, alpha):
+        """Return the positions at the fraction 'alpha' of the last step."""
+        return self.previous_pos + (self.pos - self.previous_pos) * alpha
+
+
+class SnapshotBuffer:
+    """Ring of 'slots' snapshots, written by one thread and read by another."""
+
+    def __init__(self, capacity=4, slots=3):
+        self.slots = [Snapshot(capacity) for _ in range(slots)]
+        self.lock = threading.Lock()
+        self.newest = None
+        self.reading = None
+        # Number of snapshots published
+        self.published = 0
+
+    def publish(self, world, previous_pos, due):
+        """Write a snapshot of 'world' and make it the newest one."""
+        with self.lock:
+            free = next(k for k in range(len(self.slots))
+                        if k != self.newest and k != self.reading)
+        self.slots[free].write(world, previous_pos, due)
+        with self.lock:
+            self.newest = free
+            self.published += 1
+
+    def latest(self):
+        """Return the newest snapshot (None if there is none yet).  It does
+        not change until 'latest' is called again."""
+        with self.lock:
+            self.reading = self.newest
+        return None if self.reading is None else self.slots[self.reading]
+
+
+class SimulationThread(threading.Thread):
+    """Run the 'FixedTimestep' 'simulation' in a thread, calling
+    'before_step' before every step and publishing a snapshot to 'buffer'
+    after the steps.
+
+    Other threads must hold 'lock' while they change the world.
+    """
+
+    def __init__(self, simulation, before_step=None):
+        super().__init__(name="simulation", daemon=True)
+        self.simulation = simulation
+        self.before_step = before_step
+        self.buffer = SnapshotBuffer(len(simulation.world.speed))
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        with self.lock:
+            self._publish()
+
+    def _publish(self):
+        simulation = self.simulation
+        due = simulation.last_time - simulation.accumulator
+        self.buffer.publish(simulation.world, simulation.previous_pos, due)
+
+    def alpha(self, snapshot):
+        """Return the fraction of a step elapsed since 'snapshot' was due."""
+        elapsed = self.simulation.clock.now() - snapshot.due
+        return min(max(elapsed / self.simulation.dt, 0.0), 1.0)
+
+    def run(self):
+        simulation = self.simulation
+        while not self.stopped.is_set():
+            with self.lock:
+                if simulation.advance(self.before_step):
+                    self._publish()
+                wait = simulation.dt - simulation.accumulator
+            # Sleep until the next step is due
+            self.stopped.wait(max(wait, 0.0))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
@@ -0,0 +1,157 @@
+# Instrumentation of the main loop of the game.
+#
+# The profiler measures the duration of every phase of every frame (e.g.
+# simulation, drawing, updating the display, handling events) and counts
+# events per frame (e.g. collision checks and blits).  The measurements of
+# the last frames are kept in ring buffers, from which rolling percentiles
+# are computed, e.g. for the overlay in the game.  All measurements can also
+# be written as trace in the format of the Chrome tracing viewer, which can
+# be opened in chrome://tracing, Perfetto or speedscope (as flame graph).
+#
+# This module does not depend on pygame.
+
+import json
+import time
+from collections import deque
+
+import numpy as np
+
+
+class _Phase:
+    # Context manager measuring one phase
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, self.start, time.perf_counter())
+
+
+class FrameProfiler:
+    """Measure the phases and count the events of every frame.
+
+    A frame is enclosed by 'begin_frame' and 'end_frame', a phase within it
+    is measured with 'with profiler.phase(name):'.  Statistics are computed
+    over the last 'history' frames.  If 'trace' is true, the last
+    'trace_frames' frames are kept for 'dump_trace'.
+    """
+
+    def __init__(self, history=240, trace=False, trace_frames=36000):
+        self.history = history
+        # Number of frames completed
+        self.frame = 0
+        # Names of the phases and counters, in the order of their first use
+        self.phases = []
+        self.counters = []
+        # Ring buffers of the durations (in seconds) and counts per frame
+        self.frame_times = np.zeros(history)
+        self.times = {}
+        self.counts = {}
+        # Counters watched by the profiler: name -> [function, last value]
+        self.watched = {}
+        self.trace = deque(maxlen=trace_frames) if trace else None
+        self.trace_start = time.perf_counter()
+        self._frame_start = None
+        self._events = []
+        self._counted = {}
+
+    def begin_frame(self):
+        self._frame_start = time.perf_counter()
+        self._events = []
+        self._counted = {}
+
+    def phase(self, name):
+        """Return a context manager measuring the phase 'name'."""
+        return _Phase(self, name)
+
+    def add(self, name, start, end):
+        """Add a phase measured from 'start' to 'end' (perf_counter)."""
+        if name not in self.times:
+            self.phases.append(name)
+            self.times[name] = np.zeros(self.history)
+        self._events.append((name, start, end))
+
+    def count(self, name, number=1):
+        """Count 'number' events called 'name' in the current frame."""
+        self._counted[name] = self._counted.get(name, 0) + int(number)
+
+    def watch(self, name, function):
+        """Count the increase of 'function()' per frame as 'name', e.g. of a
+        counter of the simulation."""
+        self.watched[name] = [function, function()]
+
+    def end_frame(self):
+        end = time.perf_counter()
+        for name, item in self.watched.items():
+            value = item[0]()
+            self.count(name, value - item[1])
+            item[1] = value
+        slot = self.frame % self.history
+        self.frame_times[slot] = end - self._frame_start
+        for name in self.phases:
+            self.times[name][slot] = 0
+        for name, start, stop in self._events:
+            self.times[name][slot] += stop - start
+        for name, number in self._counted.items():
+            if name not in self.counts:
+                self.counters.append(name)
+                self.counts[name] = np.zeros(self.history)
+        for name in self.counters:
+            self.counts[name][slot] = self._counted.get(name, 0)
+        if self.trace is not None:
+            self.trace.append((self.frame, self._frame_start, end, self._events,
+                               self._counted))
+        self.frame += 1
+
+    def _recent(self, ring):
+        # The values of the frames in the ring buffer, oldest first
+        if self.frame < self.history:
+            return ring[:self.frame]
+        return np.roll(ring, -(self.frame % self.history))
+
+    def recent_times(self, name):
+        """Return the durations of the phase 'name' in the last frames."""
+        return self._recent(self.times[name])
+
+    def percentiles(self, name, q=(50, 90, 99)):
+        """Return the percentiles 'q' of the duration of the phase 'name'
+        (or of the whole frame for None) in milliseconds."""
+        ring = self.frame_times if name is None else self.times[name]
+        values = self._recent(ring)
+        if len(values) == 0:
+            return np.zeros(len(q))
+        return 1e3 * np.percentile(values, q)
+
+    def mean_count(self, name):
+        """Return the mean number of events 'name' per frame."""
+        values = self._recent(self.counts[name])
+        return values.mean() if len(values) else 0.0
+
+    def fps(self):
+        """Return the mean frame rate of the last frames."""
+        values = self._recent(self.frame_times)
+        if len(values) == 0 or values.sum() == 0:
+            return 0.0
+        return len(values) / values.sum()
+
+    def dump_trace(self, path):
+        """Write the kept frames as JSON in the Chrome trace event format."""
+        def us(t):
+            return round(1e6 * (t - self.trace_start), 3)
+        events = []
+        for frame, start, end, phases, counted in self.trace or ():
+            events.append({"name": "frame", "ph": "X", "pid": 1, "tid": 1,
+                           "ts": us(start), "dur": round(us(end) - us(start), 3),
+                           "args": {"frame": frame}})
+            for name, t0, t1 in phases:
+                events.append({"name": name, "ph": "X", "pid": 1, "tid": 1,
+                               "ts": us(t0), "dur": round(us(t1) - us(t0), 3)})
+            if counted:
+                events.append({"name": "counts", "ph": "C", "pid": 1,
+                               "ts": us(start), "args": counted})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
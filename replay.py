@@ -0,0 +1,313 @@
+#! /usr/bin/env python3
+#
+# Recording and replay of games.
+#
+# The recorder writes the inputs of all figures (of the user and of the bots)
+# in every step of the world into a compact binary file: the directions that
+# changed since the previous step and the figures that activated the booster.
+# Since the simulation is deterministic, this is enough to re-run the game
+# exactly.  The full state of the world is only written at the beginning and
+# when it was changed from outside (a keyframe), and a checksum of the state is
+# written regularly to detect when a replay diverges from the recorded game.
+#
+# The replay runs without a window, as fast as possible, or shows a range of
+# the recorded steps:
+#
+#     python3 main.py --record game.rec
+#     python3 replay.py game.rec
+#     python3 replay.py game.rec --show 1200:2400 [--speed 0.5]
+
+import argparse
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from world import BT, Wall, World
+
+MAGIC = b"ARENAREC"
+VERSION = 1
+
+# The file starts with the parameters of the world and its walls
+HEADER = struct.Struct("<8sHdd5dH")
+WALL = struct.Struct("<4dBddH")
+# Then the records follow, each starting with its tag
+TICK = 1       # inputs of one step, followed by the step
+KEYFRAME = 2   # full state of the world
+CHECK = 3      # checksum of the state of the world
+TICK_HEADER = struct.Struct("<BHH")          # tag, changed directions, boosts
+KEYFRAME_HEADER = struct.Struct("<BIdH")     # tag, tick, time, figures
+CHECK_RECORD = struct.Struct("<BII")         # tag, tick, checksum
+
+# A direction that changed
+INPUT_ROW = np.dtype([("index", "<u2"), ("direction", "<f8", 2)])
+# The state of one figure in a keyframe
+FIGURE_ROW = np.dtype([
+    ("pos", "<f8", 2),
+    ("direction", "<f8", 2),
+    ("heading", "<f8", 2),
+    ("speed", "<f8"),
+    ("dizzy", "<f8"),
+    ("alive", "u1"),
+    ("character", "u1"),
+])
+
+
+def checksum(world):
+    """Return a checksum of the state of the figures of 'world'."""
+    n = world.n
+    crc = 0
+    for array in (world.pos, world.heading, world.speed, world.dizzy, world.alive):
+        crc = zlib.crc32(array[:n].tobytes(), crc)
+    return crc
+
+
+class Recorder:
+    """Record the game played in 'world' into the file 'path'.
+
+    'record' has to be called before every step of the world (after the bots
+    made their moves), and 'keyframe' whenever the state of the world was
+    changed other than by the inputs and the steps.  'dt' is the duration of
+    a step, 'characters' are the indices of the characters of the figures.
+    """
+
+    # Number of steps between two checksums
+    check_every = 120
+
+    def __init__(self, world, path, dt, characters=()):
+        self.world = world
+        self.characters = characters
+        self.file = open(path, "wb")
+        walls = world.colcont.walls
+        self.file.write(HEADER.pack(MAGIC, VERSION, dt, world.size,
+                                    *(getattr(world, name) for name in World.parameters),
+                                    len(walls)))
+        for wall in walls:
+            pattern = wall.pattern.encode("ascii")
+            self.file.write(WALL.pack(*tuple(wall.rect), wall.type_.value,
+                                      wall.x_rep, wall.y_rep, len(pattern)) + pattern)
+        self.keyframe()
+
+    def keyframe(self):
+        """Record the full state of the world."""
+        world = self.world
+        n = world.n
+        rows = np.zeros(n, dtype=FIGURE_ROW)
+        rows["pos"] = world.pos[:n]
+        rows["direction"] = world.direction[:n]
+        rows["heading"] = world.heading[:n]
+        rows["speed"] = world.speed[:n]
+        rows["dizzy"] = world.dizzy[:n]
+        rows["alive"] = world.alive[:n]
+        characters = np.asarray(self.characters[:n], dtype=np.uint8)
+        rows["character"][:len(characters)] = characters
+        self.file.write(KEYFRAME_HEADER.pack(KEYFRAME, world.tick, world.time, n)
+                        + rows.tobytes())
+        self.direction = world.direction[:n].copy()
+
+    def record(self):
+        """Record the inputs for the next step."""
+        world = self.world
+        n = world.n
+        if n != len(self.direction):
+            self.keyframe()
+        elif world.tick % self.check_every == 0:
+            self.file.write(CHECK_RECORD.pack(CHECK, world.tick, checksum(world)))
+        direction = world.direction[:n]
+        changed = np.nonzero(np.any(direction != self.direction, axis=1))[0]
+        boosted = np.nonzero(world.boosted[:n])[0]
+        rows = np.zeros(len(changed), dtype=INPUT_ROW)
+        rows["index"] = changed
+        rows["direction"] = direction[changed]
+        self.file.write(TICK_HEADER.pack(TICK, len(changed), len(boosted))
+                        + rows.tobytes() + boosted.astype("<u2").tobytes())
+        self.direction[changed] = direction[changed]
+
+    def close(self):
+        self.file.close()
+
+
+class Replay:
+    """Re-run the game recorded in the file 'path'.
+
+    The world of the replay is 'world'; 'step' advances it by one step.
+    'mismatches' are the ticks at which the state of the replay differed
+    from the recorded game.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = f.read()
+        (magic, version, self.dt, size, *constants,
+         n_walls) = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a recording of this version".format(path))
+        offset = HEADER.size
+        self.walls = []
+        for _ in range(n_walls):
+            *rect, type_, x_rep, y_rep, length = WALL.unpack_from(self.data, offset)
+            offset += WALL.size
+            pattern = self.data[offset:offset + length].decode("ascii")
+            offset += length
+            self.walls.append(Wall(tuple(rect), BT(type_), pattern, x_rep, y_rep))
+        self.offset = offset
+        self.world = World(size, self.walls)
+        for name, value in zip(World.parameters, constants):
+            setattr(self.world, name, value)
+        self.characters = np.zeros(0, dtype=np.uint8)
+        self.mismatches = []
+        self.check = None
+
+    def step(self):
+        """Process the records up to the next step and do it.  Return False
+        at the end of the recording."""
+        data = self.data
+        world = self.world
+        while self.offset < len(data):
+            tag = data[self.offset]
+            if tag == TICK:
+                _, n_changed, n_boosted = TICK_HEADER.unpack_from(data, self.offset)
+                offset = self.offset + TICK_HEADER.size
+                end = offset + n_changed * INPUT_ROW.itemsize + n_boosted * 2
+                if end > len(data):
+                    break
+                rows = np.frombuffer(data, dtype=INPUT_ROW, count=n_changed, offset=offset)
+                world.direction[rows["index"]] = rows["direction"]
+                offset += n_changed * INPUT_ROW.itemsize
+                for index in np.frombuffer(data, dtype="<u2", count=n_boosted, offset=offset):
+                    world.activate_boost(index)
+                if self.check is not None:
+                    tick, crc = self.check
+                    if tick != world.tick or crc != checksum(world):
+                        self.mismatches.append(tick)
+                    self.check = None
+                self.offset = end
+                world.step(self.dt)
+                return True
+            elif tag == KEYFRAME:
+                _, tick, time_, n = KEYFRAME_HEADER.unpack_from(data, self.offset)
+                offset = self.offset + KEYFRAME_HEADER.size
+                end = offset + n * FIGURE_ROW.itemsize
+                if end > len(data):
+                    break
+                rows = np.frombuffer(data, dtype=FIGURE_ROW, count=n, offset=offset)
+                self._load(tick, time_, rows)
+                self.offset = end
+            elif tag == CHECK:
+                if self.offset + CHECK_RECORD.size > len(data):
+                    break
+                # The checksum is compared after the inputs of the next step
+                # have been applied, as it was computed by the recorder
+                self.check = CHECK_RECORD.unpack_from(data, self.offset)[1:]
+                self.offset += CHECK_RECORD.size
+            else:
+                raise ValueError("Invalid record at byte {}".format(self.offset))
+        # The end of the file, or a record cut off at the end
+        return False
+
+    def _load(self, tick, time_, rows):
+        world = self.world
+        n = len(rows)
+        while world.n < n:
+            world.add_figure()
+        world.n = n
+        world.tick = tick
+        world.time = time_
+        world.pos[:n] = rows["pos"]
+        world.direction[:n] = rows["direction"]
+        world.heading[:n] = rows["heading"]
+        world.speed[:n] = rows["speed"]
+        world.dizzy[:n] = rows["dizzy"]
+        world.alive[:n] = rows["alive"].astype(bool)
+        self.characters = rows["character"].copy()
+
+    def run(self, until=None):
+        """Replay up to the tick 'until' (or to the end).  Return whether
+        the end of the recording has not been reached."""
+        while until is None or self.world.tick < until:
+            if not self.step():
+                return False
+        return True
+
+
+def show(replay, until, speed=1.0):
+    """Show the replay in a window up to the tick 'until', with 'speed'
+    times the real speed."""
+    import pygame
+
+    import main
+
+    pygame.display.init()
+    window = pygame.display.set_mode([main.SCREEN_W, main.SCREEN_H])
+    walls = [main.Border(wall) for wall in replay.walls]
+    background_layers = main.create_background()
+    # In arenas larger than the window, the camera follows the first figure
+    rects = np.array([tuple(wall.rect) for wall in replay.walls]).reshape(-1, 4)
+    arena_size = np.maximum((rects[:, :2] + rects[:, 2:]).max(axis=0, initial=0),
+                            (main.SCREEN_W, main.SCREEN_H))
+    camera = main.Camera(arena_size)
+    renderer = main.Renderer(window, walls, background_layers, camera)
+    # The figures of the game are views onto a world of their own, into
+    # which the state of the replay is copied
+    view = World(replay.world.size)
+    figures = []
+    clock = pygame.time.Clock()
+    steps = 0.0
+    running = until is None or replay.world.tick < until
+    while running:
+        for event in pygame.event.get():
+            if (event.type == pygame.QUIT
+                    or event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                return
+        frame_time = clock.tick(60) / 1000
+        steps += speed * frame_time / replay.dt
+        while steps >= 1 and running:
+            steps -= 1
+            running = replay.step() and (until is None or replay.world.tick < until)
+        world = replay.world
+        n = world.n
+        while len(figures) < n:
+            index = len(figures)
+            character = replay.characters[index] if index < len(replay.characters) else 0
+            figures.append(main.Figure(*main.CHARACTERS[character], view))
+        view.pos[:n] = world.pos[:n]
+        view.alive[:n] = world.alive[:n]
+        if n > 0:
+            camera.follow(world.pos[0])
+        for layer in background_layers:
+            layer.update(frame_time)
+        sprites = []
+        for figure in figures[:n]:
+            sprites += figure.get_sprites()
+        pygame.display.update(renderer.draw(sprites))
+
+
+def main_replay():
+    parser = argparse.ArgumentParser(description="Replay a recorded game.")
+    parser.add_argument("path", help="file recorded with 'main.py --record'")
+    parser.add_argument("--show", metavar="START:END",
+                        help="show the steps from START to END in a window")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="speed of the shown replay relative to real time")
+    args = parser.parse_args()
+
+    replay = Replay(args.path)
+    if args.show:
+        start, _, end = args.show.partition(":")
+        replay.run(int(start) if start else 0)
+        show(replay, int(end) if end else None, args.speed)
+    else:
+        start = time.perf_counter()
+        replay.run()
+        duration = time.perf_counter() - start
+        world = replay.world
+        print("{} steps ({:.1f} s of game) replayed in {:.3f} s, {:.0f} times real speed"
+              .format(world.tick, world.time, duration, world.time / max(duration, 1e-9)))
+    if replay.mismatches:
+        print("The replay diverged from the recording at tick {}".format(replay.mismatches[0]))
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main_replay()
@@ -0,0 +1,165 @@
+# Going back in time, for rollback in online games.
+#
+# To play online without waiting for the inputs of the other players, a
+# client predicts them (e.g. that everybody keeps their direction) and
+# corrects its prediction when the real inputs arrive: it goes back to the
+# step of these inputs and simulates the steps since then again.  This needs
+# the states of the world and the inputs of all figures in the last steps.
+#
+# Both are kept in rings of preallocated slots with a fixed layout, one row
+# per figure (like the keyframes of a recording, see replay.py).  Saving or
+# restoring a state copies a few arrays, which costs the same however many
+# steps are kept, and nothing is allocated while the game runs.  The state
+# of a world is completely contained in its arrays, its tick and its time
+# (see 'World'), so nothing else has to be saved.
+#
+# This module does not depend on pygame.
+
+import numpy as np
+
+# The state of one figure at the beginning of a step
+STATE_ROW = np.dtype([
+    ("pos", "<f8", 2),
+    ("direction", "<f8", 2),
+    ("heading", "<f8", 2),
+    ("speed", "<f8"),
+    ("dizzy", "<f8"),
+    ("alive", "?"),
+])
+# The input of one figure in a step: its direction and whether it activated
+# the booster
+INPUT_ROW = np.dtype([("direction", "<f8", 2), ("boost", "?")])
+
+_STATE_FIELDS = STATE_ROW.names
+
+
+class Rollback:
+    """Keep the states of 'world' and the inputs of its figures in the last
+    'depth' steps of 'dt' seconds, to simulate them again with corrected
+    inputs.
+
+    'step' replaces 'world.step': it records the inputs given since the last
+    step (the directions and the boosts), does the step and saves the new
+    state.  'recorded_inputs' returns the inputs of an earlier step, which
+    can be corrected, and 'resimulate' goes back to that step and simulates
+    the steps since then again.  The inputs are replayed as recorded, the
+    bots do not think again; the inputs given since the last step are kept
+    for the current one.
+    """
+
+    def __init__(self, world, dt, depth=64):
+        self.world = world
+        self.dt = dt
+        self.depth = depth
+        # Tick, time and number of figures of the state in every slot (the
+        # tick is -1 for an empty slot)
+        self.ticks = np.full(depth, -1)
+        self.times = np.zeros(depth)
+        self.counts = np.zeros(depth, dtype=int)
+        self._allocate(len(world.speed))
+        self.save()
+
+    def _allocate(self, capacity):
+        states = np.zeros((self.depth, capacity), dtype=STATE_ROW)
+        inputs = np.zeros((self.depth, capacity), dtype=INPUT_ROW)
+        if hasattr(self, "states"):
+            states[:, :self.states.shape[1]] = self.states
+            inputs[:, :self.inputs.shape[1]] = self.inputs
+        self.states = states
+        self.inputs = inputs
+        # Views of the columns of every slot, such that saving and restoring
+        # only copies
+        self._state_columns = [[states[slot][name] for name in _STATE_FIELDS]
+                               for slot in range(self.depth)]
+        self._input_columns = [(inputs[slot]["direction"], inputs[slot]["boost"])
+                               for slot in range(self.depth)]
+
+    def _world_columns(self):
+        world = self.world
+        return (world.pos, world.direction, world.heading, world.speed, world.dizzy,
+                world.alive)
+
+    def save(self):
+        """Save the state of the world at the beginning of its current step."""
+        world = self.world
+        n = world.n
+        if n > self.states.shape[1]:
+            self._allocate(len(world.speed))
+        slot = world.tick % self.depth
+        for column, array in zip(self._state_columns[slot], self._world_columns()):
+            column[:n] = array[:n]
+        self.ticks[slot] = world.tick
+        self.times[slot] = world.time
+        self.counts[slot] = n
+
+    def reset(self):
+        """Forget the steps kept so far and save the current state, e.g.
+        after the world was changed other than by inputs and steps (like
+        adding a figure), since the steps before cannot be simulated again."""
+        self.ticks[:] = -1
+        self.save()
+
+    def is_kept(self, tick):
+        """Return whether the world can go back to the step 'tick'."""
+        return self.ticks[tick % self.depth] == tick and tick <= self.world.tick
+
+    def restore(self, tick):
+        """Set the world back to the beginning of the step 'tick'."""
+        if not self.is_kept(tick):
+            raise ValueError("The step {} is not kept".format(tick))
+        world = self.world
+        slot = tick % self.depth
+        n = int(self.counts[slot])
+        for column, array in zip(self._state_columns[slot], self._world_columns()):
+            array[:n] = column[:n]
+        world.boosted[:n] = False
+        world.n = n
+        world.tick = tick
+        world.time = float(self.times[slot])
+
+    def recorded_inputs(self, tick):
+        """Return the inputs recorded in the step 'tick', as array of
+        INPUT_ROW, which can be changed before 'resimulate'."""
+        if not self.is_kept(tick) or tick == self.world.tick:
+            raise ValueError("The inputs of the step {} are not kept".format(tick))
+        slot = tick % self.depth
+        return self.inputs[slot, :self.counts[slot]]
+
+    def step(self):
+        """Record the inputs of the current step, do the step and save the
+        new state."""
+        world = self.world
+        slot = world.tick % self.depth
+        if self.ticks[slot] != world.tick or self.counts[slot] != world.n:
+            self.reset()
+        n = world.n
+        direction, boost = self._input_columns[slot]
+        direction[:n] = world.direction[:n]
+        boost[:n] = world.boosted[:n]
+        world.step(self.dt)
+        self.save()
+
+    def resimulate(self, tick):
+        """Go back to the beginning of the step 'tick' and simulate the steps
+        up to the current one again, with the recorded inputs, and give the
+        inputs of the current step again.  Return the number of steps
+        simulated."""
+        world = self.world
+        end = world.tick
+        n = world.n
+        pending_direction = world.direction[:n].copy()
+        pending_boost = np.flatnonzero(world.boosted[:n])
+        self.restore(tick)
+        for k in range(tick, end):
+            slot = k % self.depth
+            n = world.n
+            direction, boost = self._input_columns[slot]
+            world.direction[:n] = direction[:n]
+            for index in np.flatnonzero(boost[:n]):
+                world.activate_boost(index)
+            world.step(self.dt)
+            self.save()
+        world.direction[:n] = pending_direction
+        for index in pending_boost:
+            world.activate_boost(index)
+        return end - tick
@@ -0,0 +1,1024 @@
+# Simulation state of the game.
+#
+# The state of all figures (position, direction, speed, dizziness, ...) is
+# kept in contiguous NumPy arrays, one row per figure, so that all figures can
+# be advanced together in one batched step per tick.  For a few figures, the
+# overhead of every call of NumPy is larger than the arithmetic, so their step
+# is computed with Python floats instead, with the same results up to
+# rounding.  The class 'Figure' in main.py is only a thin view onto one row of
+# this state.
+#
+# This module does not depend on pygame, so the simulation can also be run
+# without a window.
+
+import math
+import time
+from collections import namedtuple
+from enum import Enum
+
+import numpy as np
+
+
+class BT(Enum):
+    """Type of border"""
+    Bottom = 0
+    Top = 1
+    Left = 2
+    Right = 3
+
+
+class CT(Enum):
+    """Type of collision"""
+    NoCollision = 0
+    Horizontal = 1
+    Vertical = 2
+    Player = 3
+    Critical = 10
+
+
+# A wall of an arena: its bounding box (x, y, width, height), its type (a BT),
+# the pattern of normal ("-") and dangerous ("X") segments along the wall,
+# and the length of one segment in x or in y.
+Wall = namedtuple("Wall", "rect type_ pattern x_rep y_rep")
+
+
+def default_walls(width, height, size):
+    """Return the walls of thickness 'size' around an arena."""
+    bottom = "-----XXXX----------XXXX-----"
+    top = "--XX--XX--X--XX--XX--"
+    side = "---XX--XX---"
+    return [
+        Wall((0, 0, size, height), BT.Left, side, 0, height / len(side)),
+        Wall((width - size, 0, size, height), BT.Right, side, 0, height / len(side)),
+        Wall((0, height - size, width, size), BT.Bottom, bottom, width / len(bottom), 0),
+        Wall((0, 0, width, size), BT.Top, top, width / len(top), 0),
+    ]
+
+
+class World:
+    """State of all figures in a game, stored as a struct of arrays.
+
+    Positions are the centres of the figures (in pixel), directions are
+    2-vectors.  'direction' is the direction requested by the player or the
+    AI, 'heading' is the actual (normalized) direction of motion.  'dizzy' is
+    the remaining time of dizziness in seconds; when dizzy, a figure cannot
+    change its direction or activate the booster.  'boosted' marks the
+    figures that activated the booster since the last step.
+    """
+
+    normalspeed = 500  # pixel per second
+    boostspeed = 1500  # pixel per second
+    acceleration = 600.0  # pixel per second^2
+    boostduration = 0.2  # second
+    dizzyduration = 0.2  # second
+    # Names of the constants above, which can be changed per world
+    parameters = ("normalspeed", "boostspeed", "acceleration", "boostduration",
+                  "dizzyduration")
+    # Number of figures up to which a step is computed with Python floats
+    # instead of NumPy arrays: for a few figures, the overhead of every call
+    # of NumPy is larger than the arithmetic (see '_step_scalar')
+    scalar_max = 16
+
+    def __init__(self, size, walls=(), capacity=4, wall_map=None):
+        # Diameter of a figure
+        self.size = size
+        # Number of figures in use
+        self.n = 0
+        # Number of time steps done and simulated time (in seconds)
+        self.tick = 0
+        self.time = 0.0
+        self.pos = np.zeros((capacity, 2))
+        self.direction = np.zeros((capacity, 2))
+        self.heading = np.zeros((capacity, 2))
+        self.speed = np.zeros(capacity)
+        self.dizzy = np.zeros(capacity)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.boosted = np.zeros(capacity, dtype=bool)
+        self.colcont = CollisionControl(self, walls, wall_map)
+
+    def add_figure(self, index=None):
+        """Reserve a new row for a figure and return its index.  If 'index'
+        is given, the row of that figure (e.g. of a player who left) is
+        used again instead."""
+        if index is None:
+            if self.n == len(self.speed):
+                self._grow(2 * len(self.speed))
+            index = self.n
+            self.n += 1
+        self.pos[index] = 0
+        self.direction[index] = 0
+        self.heading[index] = (0, 1)
+        self.speed[index] = 0
+        self.dizzy[index] = 0
+        self.alive[index] = True
+        self.boosted[index] = False
+        return index
+
+    def free_place(self, rng, lo, hi, tries=100):
+        """Return a random position within [lo, hi] where a figure touches
+        neither a wall nor another living figure (if one is found in 'tries'
+        attempts).  'rng' is a NumPy random generator."""
+        others = self.pos[:self.n][self.alive[:self.n]]
+        for _ in range(tries):
+            pos = rng.uniform(lo, hi)
+            if (self.colcont.check_walls(pos[None, :])[0] == CT.NoCollision.value
+                    and np.all(np.hypot(*(others - pos).T) > self.size)):
+                break
+        return pos
+
+    def _grow(self, capacity):
+        for name in ("pos", "direction", "heading", "speed", "dizzy", "alive",
+                     "boosted"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def activate_boost(self, index):
+        # Booster is activated immediately (without accelerating) if not dizzy
+        self.boosted[index] = True
+        if self.dizzy[index] == 0:
+            self.speed[index] = self.boostspeed
+
+    def step(self, dt):
+        """Advance all figures by 'dt' seconds.
+
+        The result only depends on the state of the world and on 'dt', so
+        the same inputs always give the same trajectories.
+        """
+        n = self.n
+        self.tick += 1
+        self.time += dt
+        self.boosted[:n] = False
+        if n == 0 or dt <= 0:
+            return
+        if n <= self.scalar_max:
+            self._step_scalar(dt)
+            return
+        alive = self.alive[:n]
+        dizzy = self.dizzy[:n]
+        speed = self.speed[:n]
+        heading = self.heading[:n]
+        # Check if still dizzy
+        np.maximum(dizzy - dt, 0, out=dizzy)
+        # Evaluate the directions set by the players; a zero direction is a
+        # request to halt, otherwise to move with normal speed in the given
+        # direction, which is only possible if not dizzy
+        request = self.direction[:n]
+        norm = np.hypot(request[:, 0], request[:, 1])
+        moving = norm > 0
+        steer = moving & (dizzy == 0) & alive
+        heading[steer] = request[steer] / norm[steer, None]
+        # Accelerate or brake as requested
+        speed_aim = np.where(moving, self.normalspeed, 0.0)
+        change = self.acceleration * dt
+        speed[:] = np.where(speed < speed_aim,
+                            np.minimum(speed + change, speed_aim),
+                            np.maximum(speed - change, speed_aim))
+        speed[~alive] = 0
+        self._move(dt)
+
+    def _move(self, dt):
+        # Move all figures in the current directions with the current speeds.
+        # Instead of moving the figures step by step, the exact time of the
+        # next impact of any figure with a wall or another figure is
+        # computed.  All figures are moved until this moment, the impact is
+        # resolved, and this is repeated until the end of the time step.  The
+        # cost therefore depends on the number of impacts, not on the speed,
+        # and the result does not depend on the order of the figures.
+        # The impacts of all figures are computed once per step; after an
+        # impact, only those of the figures involved are computed again,
+        # since all others keep moving on straight lines.
+        n = self.n
+        colcont = self.colcont
+        pos = self.pos[:n]
+        heading = self.heading[:n]
+        speed = self.speed[:n]
+        alive = self.alive[:n]
+        vel = heading * speed[:, None]
+        # Times of the impacts, since the beginning of the time step
+        t_wall, _, normal = colcont.wall_impacts(pos, vel, alive, dt)
+        t_pair, i_pair, j_pair = colcont.player_impacts(pos, vel, alive, dt)
+        now = 0.0
+        # Limit the number of impacts per time step, for the unlikely case
+        # that figures are stuck between each other; the rest of the time
+        # step is then dropped.
+        for _ in range(4*n + 16):
+            t_next = min(t_wall.min(initial=np.inf), t_pair.min(initial=np.inf))
+            if t_next > dt:
+                pos += vel * (dt - now)
+                return
+            pos += vel * (t_next - now)
+            now = t_next
+            # Resolve all impacts happening at this moment
+            hit = np.nonzero(t_wall <= t_next)[0]
+            for i in hit:
+                if colcont.is_critical(pos[i], normal[i]):
+                    alive[i] = False
+                    speed[i] = 0
+                else:
+                    # Adjust the direction according to an ideal reflection
+                    # on a solid boundary
+                    heading[i] -= 2 * np.dot(heading[i], normal[i]) * normal[i]
+                    self.dizzy[i] = self.dizzyduration
+            bumped = t_pair <= t_next
+            for i, j in zip(i_pair[bumped], j_pair[bumped]):
+                if alive[i] and alive[j]:
+                    self._bump(i, j)
+            # The impacts of the figures involved change
+            involved = np.union1d(hit, np.concatenate((i_pair[bumped], j_pair[bumped])))
+            vel[involved] = heading[involved] * speed[involved, None]
+            t, _, normal[involved] = colcont.wall_impacts(pos[involved], vel[involved],
+                                                          alive[involved], dt - now)
+            t_wall[involved] = now + t
+            keep = ~(np.isin(i_pair, involved) | np.isin(j_pair, involved))
+            t, i, j = colcont.player_impacts_of(involved, pos, vel, alive, dt - now)
+            t_pair = np.concatenate((t_pair[keep], now + t))
+            i_pair = np.concatenate((i_pair[keep], i))
+            j_pair = np.concatenate((j_pair[keep], j))
+
+    def _step_scalar(self, dt):
+        # The same as the rest of 'step' and '_move', computed with lists of
+        # Python floats, which are copied from and to the arrays once
+        n = self.n
+        pos = self.pos[:n].tolist()
+        heading = self.heading[:n].tolist()
+        speed = self.speed[:n].tolist()
+        dizzy = self.dizzy[:n].tolist()
+        alive = self.alive[:n].tolist()
+        change = self.acceleration * dt
+        for i, (dx, dy) in enumerate(self.direction[:n].tolist()):
+            dizzy[i] = max(dizzy[i] - dt, 0.0)
+            norm = math.hypot(dx, dy)
+            if norm > 0 and dizzy[i] == 0 and alive[i]:
+                heading[i] = [dx / norm, dy / norm]
+            speed_aim = self.normalspeed if norm > 0 else 0.0
+            if not alive[i]:
+                speed[i] = 0.0
+            elif speed[i] < speed_aim:
+                speed[i] = min(speed[i] + change, speed_aim)
+            else:
+                speed[i] = max(speed[i] - change, speed_aim)
+        self._move_scalar(dt, pos, heading, speed, dizzy, alive)
+        self.pos[:n] = pos
+        self.heading[:n] = heading
+        self.speed[:n] = speed
+        self.dizzy[:n] = dizzy
+        self.alive[:n] = alive
+
+    def _move_scalar(self, dt, pos, heading, speed, dizzy, alive):
+        # The same as '_move' for the lists of '_step_scalar'
+        n = self.n
+        colcont = self.colcont
+        remaining = dt
+        for _ in range(4*n + 16):
+            vel = [(h[0] * s, h[1] * s) for h, s in zip(heading, speed)]
+            t_next = math.inf
+            walls = []
+            for i in range(n):
+                vx, vy = vel[i]
+                if alive[i] and (vx != 0 or vy != 0):
+                    t, nx, ny = colcont.wall_impact(pos[i][0], pos[i][1], vx, vy, remaining)
+                    if t <= remaining:
+                        walls.append((i, t, nx, ny))
+                        t_next = min(t_next, t)
+            pairs = []
+            for i in range(n):
+                if not alive[i]:
+                    continue
+                (x, y), (vx, vy) = pos[i], vel[i]
+                for j in range(i + 1, n):
+                    if alive[j]:
+                        colcont.checks += 1
+                        t = _ray_circle_float(x - pos[j][0], y - pos[j][1],
+                                              vx - vel[j][0], vy - vel[j][1], self.size)
+                        if t <= remaining:
+                            pairs.append((i, j, t))
+                            t_next = min(t_next, t)
+            if t_next > remaining:
+                for p, (vx, vy) in zip(pos, vel):
+                    p[0] += vx * remaining
+                    p[1] += vy * remaining
+                return
+            for p, (vx, vy) in zip(pos, vel):
+                p[0] += vx * t_next
+                p[1] += vy * t_next
+            remaining -= t_next
+            # Resolve all impacts happening at this moment
+            for i, t, nx, ny in walls:
+                if t > t_next:
+                    continue
+                if colcont.is_critical(pos[i], (nx, ny)):
+                    alive[i] = False
+                    speed[i] = 0.0
+                else:
+                    hx, hy = heading[i]
+                    reflect = 2 * (hx*nx + hy*ny)
+                    heading[i] = [hx - reflect * nx, hy - reflect * ny]
+                    dizzy[i] = self.dizzyduration
+            for i, j, t in pairs:
+                if t <= t_next and alive[i] and alive[j]:
+                    # The same as '_bump'
+                    speed[i], speed[j] = speed[j], speed[i]
+                    ax = pos[i][0] - pos[j][0]
+                    ay = pos[i][1] - pos[j][1]
+                    norm = math.hypot(ax, ay)
+                    if norm > 0:
+                        heading[i] = [ax / norm, ay / norm]
+                        heading[j] = [-ax / norm, -ay / norm]
+                    dizzy[i] = dizzy[j] = self.dizzyduration
+
+    def _bump(self, i, j):
+        # TODO: make realistic collisions
+        # Take into account:
+        # After a zero-friction collision of a moving ball with a
+        # stationary one of equal mass, the angle between the
+        # directions of the two balls is 90 degrees, unless the
+        # collision is head-on. (for further information see, e.g.:
+        # https://en.wikipedia.org/wiki/Collision#Billiards)
+        # Exchange speeds (this is unrealistic)
+        self.speed[i], self.speed[j] = self.speed[j], self.speed[i]
+        # Both figures move away from each other along the line through
+        # their centres (this might be unrealistic)
+        axis = self.pos[i] - self.pos[j]
+        norm = np.hypot(*axis)
+        if norm > 0:
+            self.heading[i] = axis / norm
+            self.heading[j] = -axis / norm
+        self.dizzy[i] = self.dizzy[j] = self.dizzyduration
+
+
+class Clock:
+    """Clock in real time (in seconds)."""
+
+    def now(self):
+        return time.perf_counter()
+
+
+class ManualClock:
+    """Clock that only moves when told so, e.g. to run tests or replays."""
+
+    def __init__(self, start=0.0):
+        self.time = start
+
+    def now(self):
+        return self.time
+
+    def advance(self, dt):
+        self.time += dt
+
+
+class FixedTimestep:
+    """Drive a world with a fixed time step, independent of the frame rate.
+
+    The time elapsed on 'clock' is collected in an accumulator, from which
+    the world is advanced in steps of exactly 'dt' seconds.  Without a clock,
+    the world only moves with 'run', as fast as possible.
+    """
+
+    # Maximal number of steps per call of 'advance'; if the simulation
+    # cannot keep up with the clock, the game slows down instead of freezing.
+    max_steps = 10
+
+    def __init__(self, world, dt=1/120, clock=None):
+        self.world = world
+        self.dt = dt
+        self.clock = clock
+        self.accumulator = 0.0
+        self.last_time = clock.now() if clock is not None else None
+        # Positions of the figures before the last step
+        self.previous_pos = None
+
+    def reset(self):
+        """Forget the time elapsed since the last step (e.g. after a pause)."""
+        self.accumulator = 0.0
+        self.last_time = self.clock.now()
+
+    def advance(self, before_step=None):
+        """Do as many steps as the time elapsed on the clock allows.
+
+        'before_step' is called before every step, e.g. to let the AI make
+        its move.  Return the number of steps done.
+        """
+        current_time = self.clock.now()
+        self.accumulator += current_time - self.last_time
+        self.last_time = current_time
+        steps = 0
+        while self.accumulator >= self.dt:
+            if steps == self.max_steps:
+                self.accumulator = 0.0
+                break
+            self.accumulator -= self.dt
+            self._step(before_step)
+            steps += 1
+        return steps
+
+    def run(self, n_steps, before_step=None):
+        """Do 'n_steps' steps, regardless of the clock."""
+        for _ in range(n_steps):
+            self._step(before_step)
+
+    @property
+    def alpha(self):
+        """Fraction of a step elapsed since the last step."""
+        return min(self.accumulator / self.dt, 1.0)
+
+    def interpolated_pos(self):
+        """Return the positions of the figures between the last two steps,
+        according to the time elapsed since the last step, to draw smooth
+        motion at any frame rate.  This lags behind by at most one step."""
+        pos = self.world.pos[:self.world.n]
+        previous = self.previous_pos
+        if previous is None or len(previous) != len(pos):
+            return pos.copy()
+        return previous + (pos - previous) * self.alpha
+
+    def _step(self, before_step):
+        if before_step is not None:
+            before_step()
+        self.previous_pos = self.world.pos[:self.world.n].copy()
+        self.world.step(self.dt)
+
+
+class CollisionControl:
+    """Detect collisions of all figures of a world with walls and each other.
+
+    The walls are objects with the attributes of a 'Wall'.  'wall_map' is
+    the 'WallMap' of the walls for figures of the size of the world, if it
+    has been computed before (e.g. loaded with a compiled arena).
+    """
+
+    # Number of figures from which on the spatial hash is used to find
+    # candidates for collisions, instead of testing all pairs
+    broadphase_min = 32
+
+    def __init__(self, world, walls, wall_map=None):
+        self.world = world
+        self.walls = list(walls)
+        self.collision_partner = None
+        self.grid = SpatialHash(2 * world.size)
+        # All pairs of figures, for a number of figures below broadphase_min
+        self._all_pairs = {}
+        # Number of tests of figures against walls and against each other
+        # (for profiling)
+        self.checks = 0
+        self.wall_rect = np.array([tuple(wall.rect) for wall in self.walls],
+                                  dtype=float).reshape(-1, 4)
+        # The walls extended by the radius of the figures in x and in y,
+        # and their corners (see 'wall_impacts')
+        r = world.size / 2
+        lo = self.wall_rect[:, :2]
+        hi = lo + self.wall_rect[:, 2:]
+        self.wall_box_lo = np.stack((lo - (r, 0), lo - (0, r)), axis=1)
+        self.wall_box_hi = np.stack((hi + (r, 0), hi + (0, r)), axis=1)
+        self.wall_corners = np.stack((lo, np.stack((lo[:, 0], hi[:, 1]), axis=1),
+                                      np.stack((hi[:, 0], lo[:, 1]), axis=1), hi),
+                                     axis=1)
+        # The same shapes as Python floats, for single figures: for every
+        # wall the two extended rectangles (x0, y0, x1, y1) and the corners
+        self.wall_shapes = [
+            (tuple(box_lo[0] + box_hi[0]), tuple(box_lo[1] + box_hi[1]),
+             [tuple(corner) for corner in corners])
+            for box_lo, box_hi, corners in zip(self.wall_box_lo.tolist(),
+                                               self.wall_box_hi.tolist(),
+                                               self.wall_corners.tolist())]
+        if wall_map is None or wall_map.radius != r or wall_map.n_walls != len(self.walls):
+            wall_map = WallMap(self.walls, r)
+        self.wall_map = wall_map
+
+    def check_walls(self, centres):
+        """Return the collision type (as value of CT) with the walls for an
+        array of centres of figures."""
+        return self.wall_map.classify(centres)
+
+    def is_critical(self, centre, normal):
+        """Whether touching a wall at 'centre', where the wall has the given
+        'normal', is deadly."""
+        # Look up the type of collision just behind the point of contact
+        cell_size = self.wall_map.cell_size
+        kind = self.wall_map.classify_point(centre[0] - normal[0] * cell_size,
+                                            centre[1] - normal[1] * cell_size)
+        return kind == CT.Critical.value
+
+    def wall_impacts(self, pos, vel, alive, t_max):
+        """Compute the first impact of each moving figure with any wall.
+
+        The figures are circles with centres 'pos' moving with velocities
+        'vel'.  Return the time of impact (inf if there is none until
+        't_max'), the index of the wall and the normal of the wall at the
+        point of impact for each figure.
+        """
+        n = len(pos)
+        t_hit = np.full(n, np.inf)
+        k_hit = np.zeros(n, dtype=int)
+        normal = np.zeros((n, 2))
+        index = np.nonzero(alive & np.any(vel != 0, axis=1))[0]
+        if len(self.wall_rect) == 0 or len(index) == 0:
+            return t_hit, k_hit, normal
+        r = self.world.size / 2
+        # Only the walls close to the path of a figure are candidates
+        start = pos[index]
+        end = start + vel[index] * t_max
+        lo = np.minimum(start, end)
+        hi = np.maximum(start, end)
+        # Figures far from all walls cannot hit any
+        near = ~self.wall_map.free(lo, hi)
+        if not near.all():
+            index, start, lo, hi = index[near], start[near], lo[near], hi[near]
+            if len(index) == 0:
+                return t_hit, k_hit, normal
+        candidates = self.wall_map.candidates(lo, hi)
+        self.checks += np.count_nonzero(candidates >= 0)
+        p = start[:, None, None, :]
+        v = vel[index, None, None, :]
+        # The set of centres touching a wall is the rectangle extended by r,
+        # with rounded corners.  This is the union of the rectangle extended
+        # in x, the rectangle extended in y and four circles at the corners,
+        # so the first impact is the first entry into one of these shapes.
+        t_box, side = _ray_box(p, v, self.wall_box_lo[candidates],
+                               self.wall_box_hi[candidates])
+        t_corner = _ray_circle(p - self.wall_corners[candidates], v, r, overlap=False)
+        times = np.concatenate((t_box, t_corner), axis=-1)
+        times[(times > t_max) | (candidates[..., None] < 0)] = np.inf
+        # First impact per figure
+        flat = np.argmin(times.reshape(len(index), -1), axis=1)
+        column, shape = np.divmod(flat, times.shape[-1])
+        rows = np.arange(len(index))
+        t = times[rows, column, shape]
+        hit = np.isfinite(t)
+        rows, column, shape, t = rows[hit], column[hit], shape[hit], t[hit]
+        k = candidates[rows, column]
+        index = index[hit]
+        # Normal of the wall at the point of impact
+        nrm = np.zeros((len(index), 2))
+        on_box = shape < 2
+        axis = side[rows[on_box], column[on_box], shape[on_box]]
+        nrm[on_box, axis] = -np.sign(vel[index[on_box], axis])
+        on_corner = ~on_box
+        corner = self.wall_corners[k[on_corner], shape[on_corner] - 2]
+        contact = pos[index[on_corner]] + vel[index[on_corner]] * t[on_corner, None]
+        # (normalized, since figures overlapping a corner hit it at once)
+        radial = contact - corner
+        nrm[on_corner] = radial / np.hypot(radial[:, :1], radial[:, 1:])
+        t_hit[index] = t
+        k_hit[index] = k
+        normal[index] = nrm
+        return t_hit, k_hit, normal
+
+    def wall_impact(self, x, y, vx, vy, t_max):
+        """The same as 'wall_impacts' for a single figure at (x, y) moving
+        with (vx, vy), computed with Python floats.  Return the time of
+        impact (inf if there is none until 't_max') and the normal of the
+        wall at the point of impact."""
+        end_x = x + vx * t_max
+        end_y = y + vy * t_max
+        walls = self.wall_map.near_walls(min(x, end_x), min(y, end_y),
+                                         max(x, end_x), max(y, end_y))
+        self.checks += len(walls)
+        r = self.world.size / 2
+        t_hit = math.inf
+        side = corner = None
+        # The first entry into the shapes of all walls, in the order of
+        # 'wall_impacts'
+        for k in walls:
+            box_x, box_y, corners = self.wall_shapes[k]
+            for box in (box_x, box_y):
+                t, entry = _ray_box_float(x, y, vx, vy, *box)
+                if t < t_hit and t <= t_max:
+                    t_hit, side, corner = t, entry, None
+            for cx, cy in corners:
+                t = _ray_circle_float(x - cx, y - cy, vx, vy, r, overlap=False)
+                if t < t_hit and t <= t_max:
+                    t_hit, side, corner = t, None, (cx, cy)
+        if side == 0:
+            return t_hit, (-1.0 if vx > 0 else 1.0), 0.0
+        if side == 1:
+            return t_hit, 0.0, (-1.0 if vy > 0 else 1.0)
+        if corner is not None:
+            radial_x = x + vx * t_hit - corner[0]
+            radial_y = y + vy * t_hit - corner[1]
+            norm = math.hypot(radial_x, radial_y)
+            return t_hit, radial_x / norm, radial_y / norm
+        return t_hit, 0.0, 0.0
+
+    def candidate_pairs(self, pos, vel, alive, t_max):
+        """Broadphase: return the indices i < j of all pairs of living
+        figures which might collide until 't_max'.
+
+        For few figures these are simply all pairs; otherwise, the areas
+        swept by the figures are sorted into a uniform grid and only figures
+        sharing a cell are paired.
+        """
+        index = np.nonzero(alive)[0]
+        if len(index) < self.broadphase_min:
+            if len(index) not in self._all_pairs:
+                self._all_pairs[len(index)] = np.triu_indices(len(index), 1)
+            i, j = self._all_pairs[len(index)]
+            return index[i], index[j]
+        r = self.world.size / 2
+        start = pos[index]
+        end = start + vel[index] * t_max
+        i, j = self.grid.pairs(np.minimum(start, end) - r,
+                               np.maximum(start, end) + r)
+        return index[i], index[j]
+
+    def player_impacts(self, pos, vel, alive, t_max):
+        """Compute the impacts of moving figures with each other.
+
+        Return the times of impact and the indices i < j of all pairs of
+        living figures that collide until 't_max'.  Figures which already
+        overlap and approach each other collide immediately.
+        """
+        i, j = self.candidate_pairs(pos, vel, alive, t_max)
+        self.checks += len(i)
+        # Narrowphase: solve for the time of impact of the candidates
+        t = _ray_circle(pos[i] - pos[j], vel[i] - vel[j], self.world.size)
+        hit = t <= t_max
+        return t[hit], i[hit], j[hit]
+
+    def player_impacts_of(self, figures, pos, vel, alive, t_max):
+        """The same as 'player_impacts', but only for the pairs of living
+        figures of which at least one is among the indices 'figures'."""
+        figures = figures[alive[figures]]
+        r = self.world.size / 2
+        end = pos + vel * t_max
+        lo = np.minimum(pos, end) - r
+        hi = np.maximum(pos, end) + r
+        # The areas swept by the figures overlap
+        near = np.all((lo[figures, None] <= hi) & (hi[figures, None] >= lo), axis=2)
+        near &= alive
+        a, j = np.nonzero(near)
+        i = figures[a]
+        # Pairs of two of 'figures' are found twice
+        once = (i < j) | ((i > j) & ~np.isin(j, figures))
+        i, j = np.minimum(i[once], j[once]), np.maximum(i[once], j[once])
+        self.checks += len(i)
+        t = _ray_circle(pos[i] - pos[j], vel[i] - vel[j], self.world.size)
+        hit = t <= t_max
+        return t[hit], i[hit], j[hit]
+
+    def check_collision(self, index) -> CT:
+        """Check a single figure for collisions."""
+        centres = self.world.pos[:self.world.n]
+        wall = self.check_walls(centres[index:index+1])[0]
+        if wall != CT.NoCollision.value:
+            return CT(wall)
+        diff = centres - centres[index]
+        touch = np.hypot(diff[:, 0], diff[:, 1]) <= self.world.size
+        touch &= self.world.alive[:self.world.n]
+        touch[index] = False
+        if touch.any():
+            self.collision_partner = int(np.argmax(touch))
+            return CT.Player
+        return CT.NoCollision
+
+
+class WallMap:
+    """The walls of an arena, compiled into grids for fast lookups.
+
+    'kind' classifies every cell of 'cell_size' pixels by the collision
+    (as value of CT) a figure of the given 'radius' with its centre in this
+    cell has: none, with a horizontal or vertical wall, or a deadly one.  If
+    walls overlap, the first one in the list counts.  'near' lists for every
+    cell of 'near_size' pixels the indices of the walls that a figure with
+    its centre in this cell can touch (padded with -1).
+
+    Computing the grids takes time for large arenas; 'grids' are the
+    attributes 'origin', 'kind' and 'near' of a map of the same walls
+    computed before, which are used instead.
+    """
+
+    def __init__(self, walls, radius, cell_size=4, near_size=128, grids=None):
+        self.radius = radius
+        self.cell_size = cell_size
+        self.near_size = near_size
+        self.n_walls = len(walls)
+        if grids is not None:
+            self.origin, self.kind, self.near = grids
+        else:
+            self._build(walls, radius)
+        # For lookups with Python floats: the origin, and the walls near the
+        # cells used so far
+        self._origin = tuple(self.origin.tolist())
+        self._near_walls = {}
+
+    def _build(self, walls, radius):
+        cell_size = self.cell_size
+        near_size = self.near_size
+        rects = np.array([tuple(wall.rect) for wall in walls], dtype=float).reshape(-1, 4)
+        lo = rects[:, :2] - radius
+        hi = rects[:, :2] + rects[:, 2:] + radius
+        self.origin = np.floor(lo.min(axis=0, initial=0) / near_size) * near_size
+        end = hi.max(axis=0, initial=0)
+        # Classification of the centres
+        shape = np.ceil((end - self.origin) / cell_size).astype(int) + 1
+        self.kind = np.zeros(shape, dtype=np.uint8)
+        for k in reversed(range(len(walls))):
+            wall = walls[k]
+            c_lo = np.floor((lo[k] - self.origin) / cell_size).astype(int)
+            c_hi = np.ceil((hi[k] - self.origin) / cell_size).astype(int)
+            cx = self.origin[0] + (np.arange(c_lo[0], c_hi[0]) + 0.5) * cell_size
+            cy = self.origin[1] + (np.arange(c_lo[1], c_hi[1]) + 0.5) * cell_size
+            # Distance of the centres of the cells from the wall
+            x0, y0, w, h = rects[k]
+            dx = np.maximum(np.maximum(x0 - cx, cx - (x0 + w)), 0)
+            dy = np.maximum(np.maximum(y0 - cy, cy - (y0 + h)), 0)
+            touch = dx[:, None]**2 + dy[None, :]**2 <= radius**2
+            if wall.type_ in (BT.Top, BT.Bottom):
+                kind = np.full(touch.shape, CT.Horizontal.value)
+            else:
+                kind = np.full(touch.shape, CT.Vertical.value)
+            # The segments of the pattern start at the top left of the wall
+            danger = np.array([c == "X" for c in wall.pattern])
+            if wall.x_rep != 0:
+                segment = np.clip(((cx - x0) / wall.x_rep).astype(int), 0, len(danger) - 1)
+                kind[danger[segment], :] = CT.Critical.value
+            elif wall.y_rep != 0:
+                segment = np.clip(((cy - y0) / wall.y_rep).astype(int), 0, len(danger) - 1)
+                kind[:, danger[segment]] = CT.Critical.value
+            area = self.kind[c_lo[0]:c_hi[0], c_lo[1]:c_hi[1]]
+            area[touch] = kind[touch]
+        # Walls close to the cells
+        shape = np.ceil((end - self.origin) / near_size).astype(int) + 1
+        near = [[[] for _ in range(shape[1])] for _ in range(shape[0])]
+        for k in range(len(walls)):
+            c_lo = np.floor((lo[k] - self.origin) / near_size).astype(int)
+            c_hi = np.floor((hi[k] - self.origin) / near_size).astype(int)
+            for i in range(c_lo[0], c_hi[0] + 1):
+                for j in range(c_lo[1], c_hi[1] + 1):
+                    near[i][j].append(k)
+        width = max((len(cell) for column in near for cell in column), default=0)
+        self.near = np.full(tuple(shape) + (max(width, 1),), -1, dtype=int)
+        for i, column in enumerate(near):
+            for j, cell in enumerate(column):
+                self.near[i, j, :len(cell)] = cell
+
+    def classify(self, points):
+        """Return the collision type (as value of CT) for figures with their
+        centres at 'points'."""
+        index = np.floor((points - self.origin) / self.cell_size).astype(int)
+        inside = np.all((index >= 0) & (index < self.kind.shape), axis=1)
+        result = np.zeros(len(points), dtype=int)
+        result[inside] = self.kind[index[inside, 0], index[inside, 1]]
+        return result
+
+    def classify_point(self, x, y):
+        """The same as 'classify' for a single point (x, y)."""
+        i = math.floor((x - self._origin[0]) / self.cell_size)
+        j = math.floor((y - self._origin[1]) / self.cell_size)
+        if 0 <= i < self.kind.shape[0] and 0 <= j < self.kind.shape[1]:
+            return int(self.kind[i, j])
+        return CT.NoCollision.value
+
+    def near_walls(self, x0, y0, x1, y1):
+        """The same as 'candidates' for a single box from (x0, y0) to (x1, y1):
+        return the indices of the walls which figures with their centres
+        within the box might touch, in ascending order."""
+        i0 = math.floor((x0 - self._origin[0]) / self.near_size)
+        j0 = math.floor((y0 - self._origin[1]) / self.near_size)
+        i1 = math.floor((x1 - self._origin[0]) / self.near_size)
+        j1 = math.floor((y1 - self._origin[1]) / self.near_size)
+        if i0 == i1 and j0 == j1:
+            return self._near_cell(i0, j0)
+        if i1 - i0 > 1 or j1 - j0 > 1:
+            return range(self.n_walls)
+        walls = set()
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                walls.update(self._near_cell(i, j))
+        return sorted(walls)
+
+    def _near_cell(self, i, j):
+        walls = self._near_walls.get((i, j))
+        if walls is None:
+            walls = ()
+            if 0 <= i < self.near.shape[0] and 0 <= j < self.near.shape[1]:
+                walls = tuple(k for k in self.near[i, j].tolist() if k >= 0)
+            self._near_walls[i, j] = walls
+        return walls
+
+    def free(self, lo, hi):
+        """Return for the boxes [lo, hi] whether figures with their centres
+        within them certainly do not touch any wall."""
+        # Only boxes within one cell are tested.  Outside the grid, there are
+        # no walls, so boxes reaching out of it can be clipped to it.
+        last = np.array(self.near.shape[:2]) - 1
+        c_lo = np.minimum(np.maximum((lo - self.origin) // self.near_size, 0), last).astype(int)
+        c_hi = np.minimum(np.maximum((hi - self.origin) // self.near_size, 0), last).astype(int)
+        single = (c_lo == c_hi).all(axis=1)
+        return single & (self.near[c_lo[:, 0], c_lo[:, 1], 0] < 0)
+
+    def candidates(self, lo, hi):
+        """Return the indices of the walls which figures with their centres
+        within the boxes [lo, hi] might touch, as array with one row per box,
+        padded with -1."""
+        n = len(lo)
+        shape = np.array(self.near.shape[:2])
+        c_lo = np.floor((lo - self.origin) / self.near_size).astype(int)
+        c_hi = np.floor((hi - self.origin) / self.near_size).astype(int)
+        if 4 * self.near.shape[2] >= self.n_walls or np.any(c_hi - c_lo > 1):
+            # With few walls, it is faster to check all of them; boxes larger
+            # than a cell are rare, so all walls are checked then, too
+            return np.broadcast_to(np.arange(self.n_walls), (n, self.n_walls))
+        columns = []
+        for dx in (0, 1):
+            for dy in (0, 1):
+                cx = c_lo[:, 0] + dx
+                cy = c_lo[:, 1] + dy
+                used = ((cx <= c_hi[:, 0]) & (cy <= c_hi[:, 1])
+                        & (cx >= 0) & (cy >= 0) & (cx < shape[0]) & (cy < shape[1]))
+                cell = np.full((n, self.near.shape[2]), -1)
+                cell[used] = self.near[cx[used], cy[used]]
+                columns.append(cell)
+        # The rows are padded to the most walls near any cell of the arena,
+        # which grows with its size; they are cut to the most walls of a box
+        candidates = -np.sort(-np.concatenate(columns, axis=1), axis=1)
+        width = np.count_nonzero(candidates >= 0, axis=1).max(initial=1)
+        return candidates[:, :max(width, 1)]
+
+
+class SpatialHash:
+    """Uniform grid to find pairs of overlapping axis-aligned boxes.
+
+    The grid is rebuilt from scratch in every query, which is cheap since it
+    is done with a few sorts of NumPy arrays instead of Python loops.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+
+    def pairs(self, lo, hi):
+        """Return the indices i < j of all pairs of boxes [lo, hi] sharing a
+        cell of the grid (a superset of the overlapping pairs)."""
+        n = len(lo)
+        first, second = self._cell_pairs(lo, hi)
+        # Boxes can share more than one cell
+        code = np.unique(np.minimum(first, second) * n + np.maximum(first, second))
+        return code // n, code % n
+
+    def _cell_pairs(self, lo, hi):
+        # Like 'pairs', but unsorted and with duplicates
+        # Make the cells at least as large as the largest box, such that
+        # every box covers at most 2 x 2 cells
+        cell = max(self.cell_size, (hi - lo).max(initial=0))
+        c_lo = np.floor(lo / cell).astype(np.int64)
+        c_hi = np.floor(hi / cell).astype(np.int64)
+        origin = c_lo.min(axis=0)
+        c_lo -= origin
+        c_hi -= origin
+        rows = c_hi[:, 1].max(initial=0) + 1
+        keys = []
+        boxes = []
+        for dx in (0, 1):
+            for dy in (0, 1):
+                cx = c_lo[:, 0] + dx
+                cy = c_lo[:, 1] + dy
+                used = (cx <= c_hi[:, 0]) & (cy <= c_hi[:, 1])
+                keys.append((cx * rows + cy)[used])
+                boxes.append(np.nonzero(used)[0])
+        keys = np.concatenate(keys)
+        boxes = np.concatenate(boxes)
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        boxes = boxes[order]
+        # Pair every entry with all following entries in the same cell
+        first = []
+        second = []
+        k = 1
+        while k < len(keys):
+            same = keys[k:] == keys[:-k]
+            if not same.any():
+                break
+            first.append(boxes[:-k][same])
+            second.append(boxes[k:][same])
+            k += 1
+        if not first:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        return np.concatenate(first), np.concatenate(second)
+
+    def nearest(self, queries, points, radius, query_ids=None, point_ids=None):
+        """For every query point, return the index of the nearest of 'points'
+        (-1 if there is none).
+
+        The search starts within 'radius' around the queries and doubles the
+        radius for the queries without result.  If 'query_ids' and
+        'point_ids' are given, queries and points with the same id are not
+        paired (e.g. if they are the same figure).
+        """
+        result = np.full(len(queries), -1)
+        if len(queries) == 0 or len(points) == 0:
+            return result
+        # From this radius on, all points are found
+        everything = np.concatenate((queries, points))
+        limit = np.hypot(*np.ptp(everything, axis=0))
+        todo = np.arange(len(queries))
+        while len(todo):
+            q = queries[todo]
+            first, second = self._cell_pairs(np.concatenate((q - radius, points)),
+                                             np.concatenate((q + radius, points)))
+            # Queries come first, duplicates do not matter here
+            i = np.minimum(first, second)
+            j = np.maximum(first, second)
+            cross = (i < len(todo)) & (j >= len(todo))
+            i, j = i[cross], j[cross] - len(todo)
+            if query_ids is not None:
+                other = query_ids[todo[i]] != point_ids[j]
+                i, j = i[other], j[other]
+            # The nearest point of every query
+            distance = np.hypot(*(q[i] - points[j]).T)
+            order = np.lexsort((distance, i))
+            i, j, distance = i[order], j[order], distance[order]
+            first = np.ones(len(i), dtype=bool)
+            first[1:] = i[1:] != i[:-1]
+            i, j, distance = i[first], j[first], distance[first]
+            # A point outside of the circle with radius around the query
+            # might not be the nearest one
+            found = (distance <= radius) | (radius >= limit)
+            result[todo[i[found]]] = j[found]
+            if radius >= limit:
+                break
+            done = np.zeros(len(todo), dtype=bool)
+            done[i[found]] = True
+            todo = todo[~done]
+            radius *= 2
+        return result
+
+
+def _ray_box(p, v, lo, hi):
+    """Entry time of points 'p' moving with velocities 'v' into the boxes
+    [lo, hi].  Return the time (inf if no entry from outside happens) and the
+    axis through whose face the box is entered."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t1 = (lo - p) / v
+        t2 = (hi - p) / v
+    # Without motion along an axis, the slab is either never or always hit
+    inside = (lo <= p) & (p <= hi)
+    still = v == 0
+    t1 = np.where(still, np.where(inside, -np.inf, np.inf), t1)
+    t2 = np.where(still, np.inf, t2)
+    t_near = np.minimum(t1, t2)
+    t_far = np.maximum(t1, t2)
+    side = np.argmax(t_near, axis=-1)
+    t_in = t_near.max(axis=-1)
+    t_out = t_far.min(axis=-1)
+    # Allow for rounding errors of points which just reached the box
+    t_in = np.where((t_in >= -1e-9) & (t_in < t_out), np.maximum(t_in, 0), np.inf)
+    return t_in, side
+
+
+def _ray_box_float(px, py, vx, vy, x0, y0, x1, y1):
+    """The same as '_ray_box' for a single point and box, with Python floats."""
+    if vx == 0:
+        if not x0 <= px <= x1:
+            return math.inf, 0
+        near_x, far_x = -math.inf, math.inf
+    else:
+        t1 = (x0 - px) / vx
+        t2 = (x1 - px) / vx
+        near_x, far_x = min(t1, t2), max(t1, t2)
+    if vy == 0:
+        if not y0 <= py <= y1:
+            return math.inf, 0
+        near_y, far_y = -math.inf, math.inf
+    else:
+        t1 = (y0 - py) / vy
+        t2 = (y1 - py) / vy
+        near_y, far_y = min(t1, t2), max(t1, t2)
+    side = 0 if near_x >= near_y else 1
+    t_in = max(near_x, near_y)
+    if t_in >= -1e-9 and t_in < min(far_x, far_y):
+        return max(t_in, 0.0), side
+    return math.inf, side
+
+
+def _ray_circle_float(dx, dy, vx, vy, radius, overlap=True):
+    """The same as '_ray_circle' for a single point, with Python floats."""
+    a = vx*vx + vy*vy
+    b = dx*vx + dy*vy
+    c = dx*dx + dy*dy - radius**2
+    disc = b*b - a*c
+    t = math.inf
+    if b < 0 and disc >= 0 and a > 0:
+        t = (-b - math.sqrt(disc)) / a
+    if overlap:
+        return 0.0 if c < 0 and b < 0 else max(t, 0.0)
+    # Allow for rounding errors of points which just reached the circle
+    return math.inf if c < -1e-6 * radius else max(t, 0.0)
+
+
+def _ray_circle(d, v, radius, overlap=True):
+    """Time when points at offset 'd' from the centres of circles, moving
+    with velocities 'v' relative to them, reach the circles of 'radius'.
+    Points that are inside and moving towards the centre hit at once if
+    'overlap' is true, otherwise they do not hit at all."""
+    a = np.einsum("...i,...i", v, v)
+    b = np.einsum("...i,...i", d, v)
+    c = np.einsum("...i,...i", d, d) - radius**2
+    disc = b**2 - a*c
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (-b - np.sqrt(disc)) / a
+    t = np.where((b < 0) & (disc >= 0) & (a > 0), t, np.inf)
+    if overlap:
+        return np.where((c < 0) & (b < 0), 0.0, np.maximum(t, 0))
+    # Allow for rounding errors of points which just reached the circle
+    return np.where(c < -1e-6 * radius, np.inf, np.maximum(t, 0))